@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+"""Benchmark each entry path of cliquery's command_line_runner
+
+   Every command runs in a fresh interpreter against a private copy of the
+   cliquery package, so bookmarks and configuration are never touched, and
+   web requests go to the stand-in server in server.py. Commands that make
+   requests are measured with an empty cache and again with a primed one.
+
+   For each command the median wall time, import time (python -X
+   importtime, less the interpreter's own imports), and peak RSS are
+   printed and appended as one JSON record to the output file, so that
+   results can be compared across commits, for example
+       python benchmarks/run.py --runs 10 --output results.jsonl
+"""
+
+from __future__ import print_function
+from argparse import ArgumentParser
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import server
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNNER = 'from cliquery.cliquery import command_line_runner; ' \
+         'command_line_runner()'
+
+# Name, arguments, and whether the command makes web requests
+COMMANDS = (('version', ['-v'], False),
+            ('config', ['-c'], False),
+            ('bookmarks', ['-b'], False),
+            ('bookmark-add', ['-b', 'add', 'bench.local/page/1'], False),
+            ('search', ['-s', 'python', 'lists'], True),
+            ('describe', ['-f', '-d', 'python', 'lists'], True),
+            ('wolfram', ['-w', '2+2'], True))
+
+# Configuration of the benchmarked copy, the keys are only sent to server.py
+CONFIG = ('google_api_key:\ngoogle_engine_key:\nwolfram_api_key: bench\n'
+          'browser:\nbookmarks:\n{0}\n'
+          .format('\n'.join('http://bench.local/page/{0}'.format(i)
+                            for i in range(1, 51))))
+
+
+def get_parser():
+    """Parse command-line arguments."""
+    parser = ArgumentParser(description='benchmark cliquery commands')
+    parser.add_argument('-n', '--runs', type=int, default=5,
+                        help='runs per command (default 5)')
+    parser.add_argument('-o', '--output', type=str,
+                        default=os.path.join(ROOT, 'benchmarks',
+                                             'results.jsonl'),
+                        help='JSON Lines file results are appended to')
+    parser.add_argument('commands', metavar='COMMAND', nargs='*',
+                        help='names of commands to run (default all)')
+    return parser
+
+
+def copy_package(workdir):
+    """Copy the cliquery package into workdir, return its config path."""
+    shutil.copytree(os.path.join(ROOT, 'cliquery'),
+                    os.path.join(workdir, 'cliquery'),
+                    ignore=shutil.ignore_patterns('__pycache__', '*.pyc',
+                                                  '.local.cliqrc'))
+    return os.path.join(workdir, 'cliquery', '.local.cliqrc')
+
+
+def get_env(workdir, proxy):
+    """Return the environment commands run in, with cliquery defaults."""
+    env = dict((key, value) for key, value in os.environ.items()
+               if not key.startswith('CLIQ_') and
+               key.lower() not in ('http_proxy', 'https_proxy', 'no_proxy'))
+    env['PYTHONPATH'] = workdir
+    env['http_proxy'] = proxy
+    env['BROWSER'] = 'true'
+    return env
+
+
+def run(args, env, config_path, stderr=None):
+    """Run python with args, return its wall time in ms, peak RSS in KiB,
+       exit status, and stderr output if requested.
+    """
+    with open(config_path, 'w') as cfg:
+        cfg.write(CONFIG)
+    with open(os.devnull, 'r+') as devnull:
+        start = time.time()
+        # python -c puts the working directory first on sys.path, so run
+        # in the private copy's directory rather than the repository's
+        process = subprocess.Popen([sys.executable] + args, env=env,
+                                   cwd=env['PYTHONPATH'], stdin=devnull,
+                                   stdout=devnull, stderr=stderr or devnull)
+        output = process.stderr.read() if stderr else None
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = (time.time() - start) * 1000
+        process.returncode = os.WEXITSTATUS(status)
+    # ru_maxrss is in bytes on macOS and KiB elsewhere
+    max_rss = usage.ru_maxrss
+    if sys.platform == 'darwin':
+        max_rss //= 1024
+    return elapsed, max_rss, process.returncode, output
+
+
+def get_import_time(args, env, config_path):
+    """Return the ms spent importing modules while running python with
+       args, from the top-level entries of python -X importtime.
+    """
+    output = run(['-X', 'importtime'] + args, env, config_path,
+                 subprocess.PIPE)[3].decode('utf-8')
+    total = 0
+    for line in output.splitlines():
+        fields = line.split('|')
+        if (len(fields) == 3 and fields[1].strip().isdigit() and
+                not fields[2].startswith('  ')):
+            total += int(fields[1])
+    return total / 1000.0
+
+
+def median(values):
+    """Return the median of a list of numbers."""
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def measure(args, env, config_path, runs, cache_dir=None):
+    """Run a command runs times, return its results as a dict.
+
+       Each run gets an empty cache unless cache_dir is given.
+    """
+    walls, rss, statuses, imports = [], [], [], []
+    for _ in range(runs):
+        env['XDG_CACHE_HOME'] = cache_dir or tempfile.mkdtemp(dir=env['TMP'])
+        elapsed, max_rss, status, _ = run(args, env, config_path)
+        walls.append(elapsed)
+        rss.append(max_rss)
+        statuses.append(status)
+        env['XDG_CACHE_HOME'] = cache_dir or tempfile.mkdtemp(dir=env['TMP'])
+        imports.append(get_import_time(args, env, config_path))
+    return {'wall_ms': round(median(walls), 1),
+            'wall_ms_min': round(min(walls), 1),
+            'import_ms': round(median(imports), 1),
+            'max_rss_kib': max(rss),
+            'status': max(statuses)}
+
+
+def get_commit():
+    """Return the current git commit, or None outside a git checkout."""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                stderr=devnull).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    """Run the benchmarks and return the exit status."""
+    args = get_parser().parse_args()
+    commands = [x for x in COMMANDS
+                if not args.commands or x[0] in args.commands]
+    if not commands:
+        sys.stderr.write('No such commands, choose from {0}.\n'
+                         .format(', '.join(x[0] for x in COMMANDS)))
+        return 2
+
+    workdir = tempfile.mkdtemp(prefix='cliquery-bench-')
+    stand_in = server.start()
+    try:
+        config_path = copy_package(workdir)
+        env = get_env(workdir, 'http://127.0.0.1:{0}'.format(
+            stand_in.server_address[1]))
+        env['TMP'] = workdir
+
+        # Interpreter startup and imports, subtracted from import times
+        baseline = measure(['-c', 'pass'], env, config_path, args.runs)
+        results = {}
+        for name, command, requests in commands:
+            command = ['-c', RUNNER] + command
+            result = measure(command, env, config_path, args.runs)
+            result['import_ms'] = round(result['import_ms'] -
+                                        baseline['import_ms'], 1)
+            results[name] = result
+            if requests:
+                # Prime a shared cache, then measure answering from it
+                cache_dir = tempfile.mkdtemp(dir=workdir)
+                env['XDG_CACHE_HOME'] = cache_dir
+                run(command, env, config_path)
+                result = measure(command, env, config_path, args.runs,
+                                 cache_dir)
+                result['import_ms'] = round(result['import_ms'] -
+                                            baseline['import_ms'], 1)
+                results[name + '-cached'] = result
+    finally:
+        stand_in.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    record = {'time': datetime.datetime.utcnow().isoformat() + 'Z',
+              'commit': get_commit(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'runs': args.runs,
+              'interpreter_ms': baseline['wall_ms'],
+              'results': results}
+    with open(args.output, 'a') as output:
+        output.write(json.dumps(record, sort_keys=True) + '\n')
+
+    print('{0:16} {1:>9} {2:>9} {3:>9}  {4}'.format(
+        'command', 'wall ms', 'import ms', 'rss KiB', 'status'))
+    for name, result in sorted(results.items()):
+        print('{0:16} {1:9.1f} {2:9.1f} {3:9d}  {4}'.format(
+            name, result['wall_ms'], result['import_ms'],
+            result['max_rss_kib'], result['status']))
+    print('Appended results to {0}.'.format(args.output))
+    return 1 if any(x['status'] for x in results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""Local stand-in for the web services cliquery talks to
+
+   Runs as an HTTP proxy, so cliquery is pointed at it with http_proxy and
+   needs no changes. Requests are answered by host:
+   www.bing.com -- a page of search results linking to bench.local
+   api.wolframalpha.com -- a WolframAlpha API answer
+   bench.local -- article pages to describe
+
+   Run it on its own with
+       python benchmarks/server.py --port 8080
+"""
+
+from __future__ import print_function
+from argparse import ArgumentParser
+import threading
+
+from six.moves import range
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.urllib.parse import urlparse
+
+
+RESULTS = 10  # Number of links on a page of search results
+PARAGRAPHS = 40  # Number of paragraphs on an article page
+
+SENTENCES = ('Python lists are mutable sequences of arbitrary objects.',
+             'A list grows as items are appended to the end of it.',
+             'Slicing a list returns a new list with a copy of the items.',
+             'Lists may be sorted in place or copied into a sorted list.',
+             'Comprehensions build a list from any iterable in one line.',
+             'Indexing a list by position takes constant time.')
+
+
+def get_search_page():
+    """Return a page of Bing search results."""
+    links = ''.join('<li><h2><a href="http://bench.local/page/{0}">Python '
+                    'lists part <b>{0}</b></a></h2><p>About lists.</p></li>'
+                    .format(i) for i in range(1, RESULTS + 1))
+    return ('<html><head><title>python lists - Bing</title></head><body>'
+            '<ol id="b_results">{0}</ol></body></html>'.format(links))
+
+
+def get_wolfram_pod(title, text):
+    """Return a WolframAlpha pod."""
+    return ('<pod title="{0}"><subpod title=""><plaintext>{1}</plaintext>'
+            '</subpod></pod>'.format(title, text))
+
+
+def get_wolfram_answer(async_pods=False):
+    """Return a WolframAlpha API answer, with the last pod sent later as
+       an async pod if requested.
+    """
+    pods = ''.join(get_wolfram_pod(title, text) for title, text in
+                   (('Input', '2 + 2'), ('Result', '4'),
+                    ('Visual representation', '....')))
+    if async_pods:
+        pods += ('<pod title="Number name" async="http://api.wolframalpha'
+                 '.com/v2/asyncPod.jsp?id=1"/>')
+    else:
+        pods += get_wolfram_pod('Number name', 'four')
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<queryresult success="true" numpods="{0}">{1}</queryresult>'
+            .format(pods.count('<pod '), pods))
+
+
+def get_article(num):
+    """Return an article page to describe."""
+    paragraphs = ''.join(
+        '<p>{0}</p>'.format(' '.join(SENTENCES[(i + j) % len(SENTENCES)]
+                                     for j in range(4)))
+        for i in range(PARAGRAPHS))
+    return ('<html><head><title>Python lists part {0}</title>'
+            '<script>var x = 1;</script></head><body><div id="nav">Home | '
+            'About</div><article><h1>Python lists part {0}</h1>{1}</article>'
+            '</body></html>'.format(num, paragraphs))
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Answer proxied GET requests by host."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        host = url.hostname or self.headers.get('Host', '').split(':')[0]
+        content_type = 'text/html; charset=utf-8'
+        if host == 'www.bing.com' and url.path == '/search':
+            body = get_search_page()
+        elif host == 'api.wolframalpha.com':
+            if url.path == '/v2/asyncPod.jsp':
+                body = get_wolfram_pod('Number name', 'four')
+            else:
+                body = get_wolfram_answer('async=true' in url.query)
+            content_type = 'text/xml; charset=utf-8'
+        elif host == 'bench.local' and url.path.startswith('/page/'):
+            body = get_article(url.path.rsplit('/', 1)[-1])
+        else:
+            self.send_error(404)
+            return
+
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    """Threaded stand-in server."""
+
+    daemon_threads = True
+
+
+def start(port=0):
+    """Serve in a background thread, return the server."""
+    server = Server(('127.0.0.1', port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    """Serve until interrupted."""
+    parser = ArgumentParser(description='stand-in for cliquery web services')
+    parser.add_argument('--port', type=int, default=8080,
+                        help='port to listen on (default 8080)')
+    port = parser.parse_args().port
+    print('Set http_proxy=http://127.0.0.1:{0} to use it.'.format(port))
+    try:
+        Server(('127.0.0.1', port), Handler).serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""Measure cliquery startup time against a budget
+
+   Trivial commands such as -v and -c should never load lxml, requests, the
+   caches, or the summarizer. This runs each command in a fresh interpreter
+   and reports the median time over the bare interpreter startup, along
+   with the import time of cliquery.cliquery reported by python -X
+   importtime.
+
+   Exits with status 1 if any measurement is over its budget, for example
+       python benchmarks/startup.py --runs 20 --import-budget 40
+"""
+
+from __future__ import print_function
+from argparse import ArgumentParser
+import compileall
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNNER = 'from cliquery.cliquery import command_line_runner; ' \
+         'command_line_runner()'
+
+# Commands measured, as arguments to command_line_runner
+COMMANDS = (['-v'], ['-c'])
+
+# Modules that trivial commands must not import
+HEAVY_MODULES = ('lxml', 'requests', 'requests_cache', 'sqlite3',
+                 'cliquery.cache', 'cliquery.pyteaser', 'cliquery.bookmark')
+
+
+def get_parser():
+    """Parse command-line arguments."""
+    parser = ArgumentParser(description='measure cliquery startup time')
+    parser.add_argument('-n', '--runs', type=int, default=10,
+                        help='runs per command (default 10)')
+    parser.add_argument('--import-budget', type=float, default=50,
+                        help='milliseconds allowed to import cliquery '
+                        '(default 50)')
+    parser.add_argument('--command-budget', type=float, default=60,
+                        help='milliseconds allowed per command over the bare '
+                        'interpreter (default 60)')
+    return parser
+
+
+def get_env():
+    """Return the environment commands run in, with an empty cache."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [x for x in [env.get('PYTHONPATH')] if x])
+    env['XDG_CACHE_HOME'] = tempfile.mkdtemp(prefix='cliquery-bench-')
+    return env
+
+
+def run(args, env, runs):
+    """Return the median wall time of running python with args in ms."""
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(runs):
+            start = time.time()
+            subprocess.check_call([sys.executable] + args, env=env,
+                                  stdout=devnull)
+            times.append((time.time() - start) * 1000)
+    return sorted(times)[len(times) // 2]
+
+
+def get_import_time(env, runs):
+    """Return the median import time of cliquery.cliquery in ms."""
+    times = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-X', 'importtime', '-c',
+             'import cliquery.cliquery'],
+            env=env, stderr=subprocess.STDOUT).decode('utf-8')
+        for line in output.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == 'cliquery.cliquery':
+                times.append(int(fields[1]) / 1000.0)
+    return sorted(times)[len(times) // 2]
+
+
+def get_heavy_imports(args, env):
+    """Return the heavy modules imported by a command."""
+    code = ('import atexit, sys; sys.argv[1:] = {0!r}; '
+            'atexit.register(lambda: sys.stderr.write(" ".join('
+            'm for m in {1!r} if m in sys.modules))); {2}'
+            .format(args, HEAVY_MODULES, RUNNER))
+    with open(os.devnull, 'w') as devnull:
+        process = subprocess.Popen([sys.executable, '-c', code], env=env,
+                                   stdout=devnull, stderr=subprocess.PIPE)
+        output = process.communicate()[1].decode('utf-8')
+    return output.split()
+
+
+def main():
+    """Measure startup and return the exit status."""
+    args = get_parser().parse_args()
+    env = get_env()
+    over_budget = False
+    # Compile stale bytecode first, rather than in the first timed run
+    compileall.compile_dir(os.path.join(ROOT, 'cliquery'), quiet=1)
+
+    bare = run(['-c', 'pass'], env, args.runs)
+    import_time = get_import_time(env, args.runs)
+    print('interpreter          {0:8.1f} ms'.format(bare))
+    print('import cliquery      {0:8.1f} ms (budget {1:g})'
+          .format(import_time, args.import_budget))
+    over_budget |= import_time > args.import_budget
+
+    for command in COMMANDS:
+        elapsed = run(['-c', RUNNER] + command, env, args.runs) - bare
+        heavy = get_heavy_imports(command, env)
+        print('cliquery {0:11} {1:8.1f} ms (budget {2:g}){3}'
+              .format(' '.join(command), elapsed, args.command_budget,
+                      ', imports ' + ' '.join(heavy) if heavy else ''))
+        over_budget |= elapsed > args.command_budget or bool(heavy)
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
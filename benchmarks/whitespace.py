@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""Compare utils.remove_whitespace with the list.pop(0) version it replaced
+
+   The previous version popped lines off the front of a list, taking time
+   quadratic in the number of lines. Both versions clean the same generated
+   text of each size, their output is checked to match, and the best time
+   of several runs is printed, for example
+       python benchmarks/whitespace.py --sizes 1000 10000 100000
+"""
+
+from __future__ import print_function
+from argparse import ArgumentParser
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cliquery import utils  # noqa: E402
+
+
+# Lines repeated to build the text, with runs of one to three blank lines.
+# Blank lines hold whitespace, the previous version dropped runs of empty
+# strings after the first.
+LINES = ('  Python lists are   mutable sequences.', ' ', '\t', 'A list grows '
+         'as\titems are appended.', ' ', '\n', '  ', 'Slicing copies a list.',
+         '\t')
+
+
+def get_parser():
+    """Parse command-line arguments."""
+    parser = ArgumentParser(description='benchmark whitespace removal')
+    parser.add_argument('-n', '--runs', type=int, default=5,
+                        help='runs per size, the best is kept (default 5)')
+    parser.add_argument('--sizes', metavar='LINES', type=int, nargs='+',
+                        default=[1000, 10000, 50000],
+                        help='numbers of lines to clean (default 1000 10000 '
+                        '50000)')
+    return parser
+
+
+def remove_whitespace_pop(text):
+    """The previous utils.remove_whitespace, kept for comparison."""
+    clean_text = []
+    curr_line = ''
+    while text:
+        if not curr_line:
+            curr_line = text.pop(0)
+            while not curr_line.strip() and text:
+                curr_line = text.pop(0)
+            if curr_line.strip():
+                clean_text.append(curr_line)
+        else:
+            curr_line = text.pop(0)
+            if text:
+                if curr_line.strip():
+                    clean_text.append(curr_line)
+                else:
+                    if not text[0].strip():
+                        if len(text) > 1 and text[1].strip():
+                            clean_text.append(curr_line)
+                    else:
+                        clean_text.append(curr_line)
+            else:
+                if curr_line.strip():
+                    clean_text.append(curr_line)
+
+    cleaner_text = []
+    clean_line = ''
+    for line in clean_text:
+        clean_line = ' '.join(line.split())
+        if not clean_line.strip():
+            clean_line += '\n'
+        cleaner_text.append(clean_line)
+    return cleaner_text
+
+
+def get_text(size):
+    """Return size lines of text, with blank lines at both ends."""
+    lines = [' ', '\n']
+    lines.extend(LINES[i % len(LINES)] for i in range(size - 4))
+    lines.extend(['\t', ' '])
+    return lines
+
+
+def best_time(func, text, runs):
+    """Return the best time in ms of func cleaning a copy of text."""
+    timer = timeit.Timer(lambda: func(list(text)))
+    return min(timer.repeat(repeat=runs, number=1)) * 1000
+
+
+def main():
+    """Run the benchmark and return the exit status."""
+    args = get_parser().parse_args()
+    print('{0:>8} {1:>12} {2:>12} {3:>8}'.format('lines', 'pop(0) ms',
+                                                 'current ms', 'speedup'))
+    for size in args.sizes:
+        text = get_text(size)
+        if remove_whitespace_pop(list(text)) != utils.remove_whitespace(text):
+            sys.stderr.write('Output differs for {0} lines.\n'.format(size))
+            return 1
+        old = best_time(remove_whitespace_pop, text, args.runs)
+        new = best_time(utils.remove_whitespace, text, args.runs)
+        print('{0:8d} {1:12.2f} {2:12.2f} {3:7.1f}x'.format(size, old, new,
+                                                            old / new))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
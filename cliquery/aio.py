@@ -0,0 +1,316 @@
+"""asyncio fetch backend for cliquery
+
+   Provides async versions of the blocking web request functions so that
+   requests to several engines, result pages, and describe targets can run
+   on a single event loop.
+
+   Requests are made with aiohttp if it is installed, the requests cache is
+   disabled, and cliquery is not offline. Otherwise the blocking functions
+   are run in the event loop's executor, which keeps the connection pooling
+   and cache semantics of the shared requests session.
+"""
+
+from __future__ import absolute_import
+import asyncio
+import random
+import sys
+import threading
+import time
+
+from lxml import etree
+import lxml.html as lh
+import requests
+
+from .open import get_offline_description, summarize_resp
+from . import cache, cliquery, utils
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+SESSION = None  # aiohttp session of the running event loop, see get_session
+
+
+def use_aiohttp():
+    """Return whether requests are made with aiohttp."""
+    return (aiohttp is not None and not utils.CACHE_ENABLED and
+            not utils.OFFLINE)
+
+
+def get_session():
+    """Get the aiohttp session for the running event loop."""
+    global SESSION
+    if SESSION is None:
+        connector = aiohttp.TCPConnector(limit=utils.POOL_CONNECTIONS *
+                                         utils.POOL_MAXSIZE,
+                                         limit_per_host=utils.POOL_MAXSIZE)
+        timeout = aiohttp.ClientTimeout(sock_connect=utils.CONNECT_TIMEOUT,
+                                        sock_read=utils.READ_TIMEOUT)
+        SESSION = aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                        trust_env=True)
+    return SESSION
+
+
+async def close_session():
+    """Close the aiohttp session and its connections."""
+    global SESSION
+    if SESSION is not None:
+        await SESSION.close()
+        SESSION = None
+
+
+async def run_blocking(func, *args):
+    """Run a blocking function in the event loop's executor."""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, func, *args)
+
+
+async def send_request(url, read):
+    """Send a GET request with aiohttp, see utils.send_with_retries.
+
+       Raise requests.exceptions.ConnectionError once retries run out.
+
+    Keyword arguments:
+    url -- URL to request (str)
+    read -- reads the response into the value returned (coroutine function)
+    """
+    for attempt in range(utils.RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(random.uniform(
+                0, utils.RETRY_BACKOFF * 2 ** (attempt - 1)))
+        utils.check_failures(url)
+
+        headers = {'User-Agent': random.choice(utils.USER_AGENTS)}
+        try:
+            async with get_session().get(url, headers=headers) as request:
+                if request.status in utils.RETRY_STATUSES:
+                    request.raise_for_status()
+                value = await read(request)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            utils.record_failure(url)
+            error = err
+            continue
+        utils.record_success(url)
+        return value
+
+    with utils.FAILURE_LOCK:
+        utils.FAILED_URLS[url] = time.time() + utils.FAILURE_TTL
+    # Fail like the blocking backend so callers handle both alike
+    raise requests.exceptions.ConnectionError(error)
+
+
+async def get_resp(url):
+    """Get webpage response as an lxml.html.HtmlElement object."""
+    if not use_aiohttp():
+        return await run_blocking(utils.get_resp, url)
+
+    async def read(request):
+        return lh.fromstring(await request.read())
+
+    try:
+        return await send_request(url, read)
+    except Exception:
+        sys.stderr.write('Failed to retrieve {0}.\n'.format(url))
+        raise
+
+
+async def get_xml_resp(url):
+    """Get XML response as an lxml.etree._Element object."""
+    if not use_aiohttp():
+        return await run_blocking(utils.get_xml_resp, url)
+
+    async def read(request):
+        return etree.fromstring(await request.read())
+
+    try:
+        return await send_request(url, read)
+    except Exception:
+        sys.stderr.write('Failed to retrieve {0}.\n'.format(url))
+        raise
+
+
+async def get_streamed_resp(url):
+    """Get webpage response by streaming it, see utils.get_streamed_resp.
+
+       Streamed pages are never cached, so aiohttp is used unless offline.
+    """
+    if aiohttp is None or utils.OFFLINE:
+        return await run_blocking(utils.get_streamed_resp, url)
+
+    async def read(request):
+        page = utils.new_page()
+        async for chunk in request.content.iter_chunked(utils.CHUNK_SIZE):
+            if utils.feed_page(page, chunk):
+                break
+        return utils.close_page(page)
+
+    try:
+        return await send_request(url, read)
+    except Exception:
+        sys.stderr.write('Failed to retrieve {0}.\n'.format(url))
+        raise
+
+
+async def get_bing_resp(query):
+    """Get response from Bing search (top 10 results)."""
+    if not query:
+        return None
+    return await get_resp(cliquery.get_bing_url(query))
+
+
+async def get_google_resp(query):
+    """Get response from Google custom search API (top 10 results).
+
+       Return response and True if Google was used (other option is Bing).
+    """
+    if not query:
+        return None, True
+
+    items = await run_blocking(cliquery.get_google_items, query)
+    if items:
+        return items, True
+
+    # If no results from Google (or no API keys), use Bing
+    return await get_bing_resp(query), False
+
+
+async def get_wolfram_resp(query):
+    """Get XML response from Wolfram API as an lxml.etree._Element object."""
+    if not query:
+        return None
+    return await get_xml_resp(cliquery.get_wolfram_url(query))
+
+
+async def get_links(query):
+    """Get result URLs and titles, see cliquery.get_links."""
+    if not query:
+        return None
+
+    # Expired links are refreshed with the blocking functions
+    links = cache.get_result('links', query,
+                             lambda: cliquery.fetch_links(query))
+    if links is None:
+        resp, google = await asyncio.wait_for(get_google_resp(query),
+                                              utils.SEARCH_DEADLINE)
+        if google:
+            urls, titles = cliquery.get_google_links(resp)
+        else:
+            urls, titles = cliquery.get_bing_links(resp)
+        links = (urls, titles, google)
+        if urls:
+            cache.set_result('links', query, links)
+    return links
+
+
+async def get_wolfram_pods(query):
+    """Get pod titles and plaintext entries, see cliquery.get_wolfram_pods."""
+    if not query:
+        return None
+
+    async def fetch():
+        # Return the pods and whether they may be cached
+        resp = await get_wolfram_resp(query)
+        pods = cliquery.get_wolfram_entries(resp)
+        if not cliquery.wolfram_succeeded(resp):
+            return pods, False
+        # Async pods are requested at once and added in order
+        urls = cliquery.get_wolfram_async_urls(resp)
+        failed = False
+        for pod in await asyncio.gather(*[get_xml_resp(x) for x in urls],
+                                        return_exceptions=True):
+            if isinstance(pod, Exception):
+                failed = True
+            else:
+                cliquery.get_wolfram_entries(pod, pods)
+        return pods, not failed
+
+    pods = cache.get_result('wolfram', query,
+                            lambda: cliquery.fetch_wolfram_pods(query))
+    if pods is None:
+        pods, complete = await asyncio.wait_for(fetch(),
+                                                utils.SEARCH_DEADLINE)
+        if complete and cliquery.wolfram_answered(pods):
+            cache.set_result('wolfram', query, pods)
+    return pods
+
+
+async def describe(url):
+    """Fetch a URL and return its summary as a list of lines."""
+    if utils.OFFLINE:
+        return await run_blocking(get_offline_description, url)
+    resp = await get_streamed_resp(url)
+    return await run_blocking(summarize_resp, resp, url)
+
+
+def describe_all(urls):
+    """Describe all URLs at once on an event loop in a background thread.
+
+       Return a future of each URL's summary, in order, so each can be shown
+       as soon as it is ready, and a function stopping the loop once done.
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.daemon = True
+    thread.start()
+    pending = [asyncio.run_coroutine_threadsafe(describe(url), loop)
+               for url in urls]
+
+    async def shutdown():
+        # Cancel pages left undescribed before closing their connections
+        tasks = [x for x in asyncio.all_tasks()
+                 if x is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await close_session()
+
+    def close():
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    return pending, close
+
+
+async def race(query, answered):
+    """Request WolframAlpha and web results at once.
+
+    Keyword arguments:
+    query -- keywords to search (str)
+    answered -- returns whether Wolfram pods have an answer (function)
+
+    Return the Wolfram pods and the web links. The web request is cancelled
+    and None is returned in its place if WolframAlpha answered.
+    """
+    web_task = asyncio.ensure_future(get_links(query))
+    try:
+        pods = await get_wolfram_pods(query)
+        if answered(pods):
+            web_task.cancel()
+            try:
+                await web_task
+            except asyncio.CancelledError:
+                pass
+            return pods, None
+    except Exception:
+        # Failure is already reported, fall back to the web results
+        pods = None
+    return pods, await web_task
+
+
+def run(coro):
+    """Run a coroutine to completion on a new event loop."""
+    async def run_and_close():
+        try:
+            return await coro
+        finally:
+            await close_session()
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(run_and_close())
+    finally:
+        loop.close()
@@ -0,0 +1,235 @@
+"""JSON API serving cliquery searches over HTTP
+
+   cliquery --serve HOST:PORT keeps one process warm, like the daemon, and
+   answers each request on its own thread:
+   GET /search?q=QUERY -- Google (or Bing) result URLs and titles
+   GET /wolfram?q=QUERY -- WolframAlpha pod titles and plaintext
+   GET /describe?url=URL -- summary of a webpage
+   GET /bookmarks?q=QUERY -- bookmarks containing every keyword, or all
+   GET /health -- status, version, and uptime
+   GET /metrics -- requests, errors, and latency of each endpoint
+
+   Every response is a JSON object. Search and Wolfram responses have the
+   fields of --batch records, and failed requests have an error field.
+"""
+
+from __future__ import absolute_import
+import json
+import os
+import sys
+import threading
+import time
+
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+from six.moves.urllib.parse import parse_qs, quote_plus, urlparse
+
+from . import batch, cliquery, config, utils, __version__
+
+
+STARTED = time.time()
+METRICS = {}  # Requests, errors, and seconds spent by endpoint
+METRICS_LOCK = threading.Lock()
+CONFIG_MTIME = None  # Modification time of the config file when last read
+CONFIG_LOCK = threading.Lock()
+
+
+class RequestError(Exception):
+    """Error answered with an HTTP status instead of a 500."""
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def refresh_config():
+    """Read the config file again if it changed since it was last read."""
+    global CONFIG_MTIME
+    with CONFIG_LOCK:
+        mtime = os.path.getmtime(config.CONFIG_FPATH)
+        if mtime != CONFIG_MTIME or not config.CONFIG:
+            config.set_config()
+            CONFIG_MTIME = mtime
+
+
+def get_param(params, name):
+    """Return a required query string parameter, or raise RequestError."""
+    values = params.get(name)
+    if not values or not values[0].strip():
+        raise RequestError(400, 'Missing parameter {0}.'.format(name))
+    return values[0].strip()
+
+
+def search(params):
+    """Return Google or Bing results for the q parameter."""
+    query = get_param(params, 'q')
+    refresh_config()
+    record = {'query': query, 'timings': {}}
+    start = time.time()
+    batch.add_web_links(record, cliquery.get_links(quote_plus(query)), start)
+    return record
+
+
+def wolfram(params):
+    """Return WolframAlpha pods for the q parameter."""
+    query = get_param(params, 'q')
+    refresh_config()
+    if not config.CONFIG['wolfram_api_key']:
+        raise RequestError(503, 'Missing WolframAlpha API key in .cliqrc '
+                           'file.')
+    record = {'query': query, 'wolfram': [], 'timings': {}}
+    start = time.time()
+    batch.add_wolfram_pods(record,
+                           cliquery.get_wolfram_pods(quote_plus(query)),
+                           start)
+    return record
+
+
+def describe(params):
+    """Return the summary of the webpage at the url parameter."""
+    from .open import get_description
+
+    url = utils.add_scheme(get_param(params, 'url'))
+    with utils.deadline():
+        summary = get_description(url)
+    if not summary:
+        raise RequestError(422, 'Failed to describe {0}.'.format(url))
+    return {'url': url, 'summary': summary}
+
+
+def bookmarks(params):
+    """Return the bookmarks containing every keyword of the q parameter."""
+    from .bookmark import split_bookmark
+
+    refresh_config()
+    keywords = params.get('q', [''])[0].lower().split()
+    found = []
+    for i, bkmark in enumerate(config.CONFIG['bookmarks']):
+        if not all(x in bkmark.lower() for x in keywords):
+            continue
+        url, tag = split_bookmark(bkmark)
+        found.append({'number': i + 1, 'url': url, 'tag': tag})
+    return {'query': ' '.join(keywords), 'bookmarks': found}
+
+
+def health(params):
+    """Return the status, version, and uptime of the server."""
+    return {'status': 'ok', 'version': __version__,
+            'uptime': time.time() - STARTED}
+
+
+def metrics(params):
+    """Return request counts and latencies by endpoint, and open breakers."""
+    with METRICS_LOCK:
+        endpoints = dict((path, dict(counts))
+                         for path, counts in METRICS.items())
+    with utils.FAILURE_LOCK:
+        down = sorted(host for host, (_, opened) in utils.BREAKERS.items()
+                      if opened is not None)
+    return {'uptime': time.time() - STARTED, 'endpoints': endpoints,
+            'hosts_down': down, 'cache': utils.CACHE_ENABLED,
+            'offline': utils.OFFLINE}
+
+
+ENDPOINTS = {'/search': search,
+             '/wolfram': wolfram,
+             '/describe': describe,
+             '/bookmarks': bookmarks,
+             '/health': health,
+             '/metrics': metrics}
+
+
+def record_request(path, seconds, failed):
+    """Add a request to the metrics of its endpoint."""
+    with METRICS_LOCK:
+        counts = METRICS.setdefault(path, {'requests': 0, 'errors': 0,
+                                           'seconds': 0.0,
+                                           'max_seconds': 0.0})
+        counts['requests'] += 1
+        counts['errors'] += int(failed)
+        counts['seconds'] += seconds
+        counts['max_seconds'] = max(counts['max_seconds'], seconds)
+
+
+def answer(path, params):
+    """Run the endpoint at path, return the HTTP status and JSON body."""
+    endpoint = ENDPOINTS.get(path)
+    if endpoint is None:
+        return 404, {'error': 'No such endpoint {0}.'.format(path)}
+    try:
+        return 200, endpoint(params)
+    except RequestError as err:
+        return err.status, {'error': str(err)}
+    except utils.CacheMiss as err:
+        return 404, {'error': 'Not cached: {0}'.format(
+            utils.hide_secrets(str(err)))}
+    except utils.DeadlineExceeded as err:
+        return 504, {'error': str(err)}
+    except IOError as err:
+        # Request errors are IOErrors
+        return 502, {'error': utils.describe_error(err)}
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Answer GET requests with the JSON of an endpoint."""
+
+    server_version = 'cliquery/{0}'.format(__version__)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        start = time.time()
+        try:
+            status, body = answer(url.path, parse_qs(url.query))
+        except Exception as err:
+            status, body = 500, {'error': utils.describe_error(err)}
+        if url.path in ENDPOINTS:
+            record_request(url.path, time.time() - start, status >= 400)
+
+        data = json.dumps(body, sort_keys=True).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    """HTTP server answering each request on its own thread."""
+    daemon_threads = True
+
+
+def parse_address(address):
+    """Parse HOST:PORT, or PORT for localhost, into a (host, port) tuple."""
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def serve(address):
+    """Serve the JSON API at address (HOST:PORT) until interrupted."""
+    import signal
+    from .daemon import warm_up
+
+    try:
+        host, port = parse_address(address)
+    except ValueError:
+        sys.stderr.write('Failed to parse address {0}, enter HOST:PORT.\n'
+                         .format(address))
+        return False
+
+    warm_up()
+    refresh_config()
+    try:
+        server = ThreadingServer((host, port), RequestHandler)
+    except (IOError, OSError) as err:
+        sys.stderr.write('Failed to serve on {0}: {1}\n'.format(address, err))
+        return False
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    sys.stderr.write('cliquery API listening on http://{0}:{1}/.\n'
+                     .format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return True
@@ -0,0 +1,226 @@
+"""Resolve many cliquery queries in one process and emit JSON Lines"""
+
+from __future__ import absolute_import, print_function
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+import asyncio
+import json
+import sys
+import time
+
+from six.moves import range, zip
+from six.moves.urllib.parse import quote_plus
+
+from .config import CONFIG, set_config
+from . import cliquery, utils
+
+
+def open_queries(source):
+    """Open the file queries are read from, or stdin if source is '-'.
+
+       Return None if the file cannot be opened.
+    """
+    if source == '-':
+        return sys.stdin
+    try:
+        return open(source, 'r')
+    except IOError as err:
+        sys.stderr.write('Failed to read {0}: {1}\n'.format(
+            source, err.strerror))
+        return None
+
+
+def read_queries(lines):
+    """Yield line numbers and queries from lines, skipping blank lines."""
+    for line_num, line in enumerate(lines, 1):
+        query = line.strip()
+        if query:
+            yield line_num, query
+
+
+def new_record(line_num, query):
+    """Return an empty JSON Lines record for a query."""
+    return {'line': line_num, 'query': query, 'engine': None,
+            'urls': [], 'titles': [], 'wolfram': [], 'errors': {},
+            'timings': {}}
+
+
+def add_wolfram_pods(record, pods, start):
+    """Add Wolfram pod titles and plaintext entries to a record."""
+    titles, entries = pods
+    if not (len(entries) == 1 and entries[0] == '{}'):
+        record['wolfram'] = [{'title': title, 'text': entry}
+                             for title, entry in zip(titles, entries)]
+    record['timings']['wolfram'] = time.time() - start
+
+
+def add_web_links(record, links, start):
+    """Add Google or Bing result URLs and titles to a record."""
+    urls, titles, google = links
+    record['engine'] = 'google' if google else 'bing'
+    record['urls'], record['titles'] = urls, titles
+    record['timings']['web'] = time.time() - start
+
+
+def add_error(record, engine, err):
+    """Add the error of an engine, wolfram or web, to a record."""
+    record['errors'][engine] = utils.describe_error(err)
+
+
+@contextmanager
+def engine_errors(record, engine):
+    """Add an error raised within the block to a record, so that the
+       other engine's results are kept.
+    """
+    try:
+        yield
+    except Exception as err:
+        add_error(record, engine, err)
+
+
+def resolve_query(line_num, query):
+    """Resolve a query to WolframAlpha pods and web results.
+
+    Keyword arguments:
+    line_num -- line number of the query in the batch source (int)
+    query -- keywords to search (str)
+
+    Return a dict which is serialized as one JSON Lines record. Both
+    engines share one search deadline, and each one's error is recorded
+    without discarding the other's results.
+    """
+    record = new_record(line_num, query)
+    start = time.time()
+    clean_query = quote_plus(query)
+    with utils.deadline():
+        if CONFIG['wolfram_api_key']:
+            with engine_errors(record, 'wolfram'):
+                wolfram_start = time.time()
+                add_wolfram_pods(record,
+                                 cliquery.get_wolfram_pods(clean_query),
+                                 wolfram_start)
+
+        with engine_errors(record, 'web'):
+            web_start = time.time()
+            add_web_links(record, cliquery.get_links(clean_query), web_start)
+    record['timings']['total'] = time.time() - start
+    return record
+
+
+async def resolve_query_async(line_num, query):
+    """Resolve a query like resolve_query, with the asyncio backend.
+
+       WolframAlpha and web results are requested at once.
+    """
+    from . import aio
+
+    record = new_record(line_num, query)
+    start = time.time()
+    clean_query = quote_plus(query)
+
+    engines = ['web']
+    if CONFIG['wolfram_api_key']:
+        engines.append('wolfram')
+
+    async def wolfram():
+        if CONFIG['wolfram_api_key']:
+            with engine_errors(record, 'wolfram'):
+                add_wolfram_pods(record,
+                                 await aio.get_wolfram_pods(clean_query),
+                                 start)
+
+    async def web():
+        with engine_errors(record, 'web'):
+            add_web_links(record, await aio.get_links(clean_query), start)
+
+    try:
+        await asyncio.wait_for(asyncio.gather(wolfram(), web()),
+                               utils.SEARCH_DEADLINE)
+    except asyncio.TimeoutError:
+        # Engines still running at the deadline were cancelled
+        err = utils.DeadlineExceeded('Search deadline exceeded.')
+        for engine in engines:
+            if (engine not in record['timings'] and
+                    engine not in record['errors']):
+                add_error(record, engine, err)
+    record['timings']['total'] = time.time() - start
+    return record
+
+
+def write_records(done):
+    """Write records of finished queries to stdout, return the error count."""
+    errors = 0
+    for future in done:
+        record = future.result()
+        errors += bool(record['errors'])
+        sys.stdout.write(json.dumps(record) + '\n')
+    sys.stdout.flush()
+    return errors
+
+
+def run_batch(source, concurrency):
+    """Resolve one query per line of source and stream the results.
+
+    Keyword arguments:
+    source -- file name to read queries from, or '-' for stdin (str)
+    concurrency -- maximum number of queries resolved at once (int)
+
+    Records are written as soon as each query finishes, so their order may
+    differ from the input. Return the number of queries that failed, or 1
+    if source cannot be read.
+    """
+    lines = open_queries(source)
+    if lines is None:
+        return 1
+    try:
+        return run_queries(read_queries(lines), concurrency)
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+
+
+def run_queries(queries, concurrency):
+    """Resolve queries like run_batch, return the number that failed."""
+    if not CONFIG:
+        set_config()
+
+    concurrency = max(1, concurrency)
+    if utils.use_asyncio():
+        from . import aio
+        return aio.run(run_queries_async(queries, concurrency))
+
+    failures = 0
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    pending = set()
+    try:
+        for line_num, query in queries:
+            # Bound the number of queries read ahead of the workers
+            if len(pending) >= concurrency * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                failures += write_records(done)
+            pending.add(pool.submit(resolve_query, line_num, query))
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            failures += write_records(done)
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=False)
+    return failures
+
+
+async def run_queries_async(queries, concurrency):
+    """Resolve queries like run_queries, with the asyncio backend."""
+    failures = [0]
+
+    async def worker():
+        # Workers share one iterator so that queries are read as needed
+        for line_num, query in queries:
+            record = await resolve_query_async(line_num, query)
+            failures[0] += bool(record['errors'])
+            sys.stdout.write(json.dumps(record) + '\n')
+            sys.stdout.flush()
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return failures[0]
@@ -5,7 +5,6 @@ from collections import OrderedDict
 import re
 import sys
 
-import lxml.html as lh
 from six import iteritems, itervalues
 from six.moves import xrange as range
 
@@ -67,6 +66,17 @@ def find_bookmark_indices(query_args):
     return bk_indices
 
 
+def split_bookmark(bkmark):
+    """Split a bookmark saved as 'url (tags)' into its URL and tags.
+
+       Return the URL and the tags, or None if the bookmark is untagged.
+    """
+    if '(' in bkmark and ')' in bkmark:
+        url, tags = bkmark.split('(', 1)
+        return url.strip(), tags.rstrip(')')
+    return bkmark, None
+
+
 def bk_num_to_url(bkmarks, num, append_arg=None):
     """Convert a bookmark number to a URL.
 
@@ -78,11 +88,7 @@ def bk_num_to_url(bkmarks, num, append_arg=None):
        Return the URL found or None.
     """
     try:
-        bkmark = bkmarks[int(num) - 1]
-        if '(' in bkmark and ')' in bkmark:
-            url = bkmark.split('(')[0].strip()
-        else:
-            url = bkmark
+        url = split_bookmark(bkmarks[int(num) - 1])[0]
         if append_arg:
             url = '{0}/{1}'.format(url.rstrip('/'), append_arg)
         return url
@@ -96,9 +102,7 @@ def print_bookmarks():
     bkmarks = CONFIG['bookmarks']
     print('Bookmarks:')
     for i, bkmark in enumerate(bkmarks):
-        if '(' in bkmark and ')' in bkmark:
-            bkmark = bkmark.split('(')[1].rstrip(')')
-        print('{0}. {1}'.format(str(i+1), bkmark))
+        print('{0}. {1}'.format(str(i+1), split_bookmark(bkmark)[1] or bkmark))
     return True
 
 
@@ -443,6 +447,8 @@ def bookmark_mv_cmd(query):
 
 def import_bookmarks(filename):
     """Import bookmarks exported from browser as HTML."""
+    import lxml.html as lh
+
     def read_bookmarks(toolbar):
         """Read bookmarks from HTML in import_bookmarks"""
         with open(filename, 'r') as bkmark_file:
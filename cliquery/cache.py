@@ -0,0 +1,430 @@
+"""cliquery caching policy and result cache
+
+   Functions include:
+   Result cache of parsed search results
+   Summary cache of described pages
+   Discovery cache of the Google API client
+   Requests cache expiration, revalidation, size bound, and pruning
+
+   The result cache stores parsed search results, such as link lists and
+   WolframAlpha pods, keyed by a canonical form of the query. A repeated
+   search is answered without a web request or parsing the response again.
+
+   The summary cache stores page summaries keyed by a hash of the page's
+   title and text, so describing an unchanged page (or a mirror of it) does
+   not summarize it again. The hash of each described URL is kept too, so
+   pages can be described offline.
+
+   Expired search results and responses are still used for up to
+   REVALIDATE_AFTER seconds, while they are refreshed in the background for
+   the next search.
+"""
+
+from __future__ import absolute_import
+from fnmatch import fnmatch
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from six import iteritems
+from six.moves.urllib.parse import unquote_plus, urlparse
+
+from . import utils
+
+
+RESULTS_FILE = '{0}_results.sqlite'.format(utils.CACHE_FILE)
+
+# Seconds before cached responses expire by host, '*' is used for any other
+# host such as described pages. Override with CLIQ_CACHE_EXPIRE, for example
+# CLIQ_CACHE_EXPIRE='www.bing.com=600,*=86400'
+EXPIRE_AFTER = {'www.bing.com': 60 * 60,
+                'www.googleapis.com': 60 * 60,
+                'api.wolframalpha.com': 60 * 60 * 24 * 30,
+                '*': 60 * 60 * 24 * 7}
+
+# Host whose expiration applies to each kind of cached result
+RESULT_HOSTS = {'links': 'www.bing.com', 'wolfram': 'api.wolframalpha.com'}
+
+# Seconds after expiring that search results and responses are still used
+# while they are refreshed in the background, 0 to wait for fresh ones
+REVALIDATE_AFTER = int(os.environ.get('CLIQ_CACHE_REVALIDATE', 60 * 60 * 24))
+REVALIDATE_HOSTS = frozenset(RESULT_HOSTS.values())
+REVALIDATING = set()  # Results being refreshed, see revalidate_result
+
+# Maximum number of cached responses, results, and summaries before the
+# least recently used are evicted
+MAX_ENTRIES = int(os.environ.get('CLIQ_CACHE_MAX_ENTRIES', 1000))
+
+# Seconds before the Google API discovery document is fetched again
+DISCOVERY_EXPIRE_AFTER = 60 * 60 * 24
+
+AGE_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24,
+             'w': 60 * 60 * 24 * 7}
+
+CONNECTION = None  # Connection to RESULTS_FILE, see get_connection
+LOCK = threading.Lock()
+
+
+def read_expire_after():
+    """Update EXPIRE_AFTER with overrides from CLIQ_CACHE_EXPIRE."""
+    for field in os.environ.get('CLIQ_CACHE_EXPIRE', '').split(','):
+        host, _, seconds = field.partition('=')
+        if host.strip() and utils.is_num(seconds):
+            EXPIRE_AFTER[host.strip()] = int(seconds)
+
+
+read_expire_after()
+
+
+def get_connection():
+    """Get the connection to the result cache, creating it on first use.
+
+       Besides results, it records when each cached response was last used.
+    """
+    global CONNECTION
+    if CONNECTION is None:
+        if not os.path.exists(utils.CACHE_DIR):
+            os.makedirs(utils.CACHE_DIR)
+        CONNECTION = sqlite3.connect(RESULTS_FILE, check_same_thread=False)
+        CONNECTION.execute('CREATE TABLE IF NOT EXISTS results ('
+                           'kind TEXT, query TEXT, value TEXT, '
+                           'created REAL, accessed REAL, '
+                           'PRIMARY KEY (kind, query))')
+        CONNECTION.execute('CREATE TABLE IF NOT EXISTS summaries ('
+                           'digest TEXT PRIMARY KEY, value TEXT, '
+                           'accessed REAL)')
+        CONNECTION.execute('CREATE TABLE IF NOT EXISTS pages ('
+                           'url TEXT PRIMARY KEY, digest TEXT, '
+                           'accessed REAL)')
+        CONNECTION.execute('CREATE TABLE IF NOT EXISTS responses ('
+                           'key TEXT PRIMARY KEY, accessed REAL)')
+        CONNECTION.execute('CREATE TABLE IF NOT EXISTS discovery ('
+                           'url TEXT PRIMARY KEY, value TEXT, created REAL)')
+    return CONNECTION
+
+
+def close():
+    """Close the connection to the result cache."""
+    global CONNECTION
+    with LOCK:
+        if CONNECTION is not None:
+            CONNECTION.close()
+            CONNECTION = None
+
+
+def canonical_query(query):
+    """Normalize the whitespace and case of a query cleaned by clean_query."""
+    return ' '.join(unquote_plus(query).lower().split())
+
+
+def get_result(kind, query, refresh=None):
+    """Get a cached result of a query, or None if it is not cached.
+
+    Keyword arguments:
+    kind -- type of result, such as links or wolfram (str)
+    query -- query cleaned by utils.clean_query (str)
+    refresh -- fetches and caches the result again, if given an expired
+               result is returned while it runs in the background (function)
+    """
+    if not utils.CACHE_ENABLED:
+        return None
+    key = (kind, canonical_query(query))
+    with LOCK:
+        with get_connection() as conn:
+            row = conn.execute('SELECT value, created FROM results '
+                               'WHERE kind = ? AND query = ?', key).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE results SET accessed = ? '
+                         'WHERE kind = ? AND query = ?', (time.time(),) + key)
+    # Expired results are still better than nothing when offline
+    age = time.time() - row[1] - get_expire_after(RESULT_HOSTS[kind])
+    if age > 0 and not utils.OFFLINE:
+        if refresh is None or age > REVALIDATE_AFTER:
+            return None
+        revalidate_result(key, refresh)
+    return json.loads(row[0])
+
+
+def set_result(kind, query, value):
+    """Cache the result of a query, value must be JSON serializable."""
+    if not utils.CACHE_ENABLED:
+        return
+    now = time.time()
+    with LOCK:
+        with get_connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO results '
+                         'VALUES (?, ?, ?, ?, ?)',
+                         (kind, canonical_query(query), json.dumps(value),
+                          now, now))
+            # Evict the least recently used results over the size bound
+            conn.execute('DELETE FROM results WHERE rowid IN ('
+                         'SELECT rowid FROM results ORDER BY accessed DESC '
+                         'LIMIT -1 OFFSET ?)', (MAX_ENTRIES,))
+
+
+def revalidate_result(key, refresh):
+    """Refresh an expired result in a background thread.
+
+       The thread is not a daemon, so an interactive search exits only once
+       the cache has been refreshed for the next one.
+    """
+    with LOCK:
+        if key in REVALIDATING:
+            return
+        REVALIDATING.add(key)
+
+    def run():
+        try:
+            with utils.revalidating():
+                refresh()
+        except Exception:
+            # The expired result is kept and tried again by the next search
+            pass
+        finally:
+            with LOCK:
+                REVALIDATING.discard(key)
+
+    threading.Thread(target=run).start()
+
+# Summary cache functions
+#
+
+
+def get_digest(title, text):
+    """Return the hash of a page's title and text used as a summary key."""
+    digest = hashlib.sha1(title.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(text.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get_summary(digest):
+    """Get a cached summary by page digest, or None if it is not cached."""
+    if not utils.CACHE_ENABLED:
+        return None
+    with LOCK:
+        with get_connection() as conn:
+            row = conn.execute('SELECT value FROM summaries WHERE digest = ?',
+                               (digest,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE summaries SET accessed = ? WHERE digest = ?',
+                         (time.time(), digest))
+    return json.loads(row[0])
+
+
+def set_summary(digest, summary):
+    """Cache the summary of a page by its digest."""
+    if not utils.CACHE_ENABLED:
+        return
+    with LOCK:
+        with get_connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO summaries VALUES (?, ?, ?)',
+                         (digest, json.dumps(summary), time.time()))
+            # Evict the least recently used summaries over the size bound
+            conn.execute('DELETE FROM summaries WHERE rowid IN ('
+                         'SELECT rowid FROM summaries ORDER BY accessed DESC '
+                         'LIMIT -1 OFFSET ?)', (MAX_ENTRIES,))
+
+
+def get_page_summary(url):
+    """Get the cached summary of the page last described at url, or None."""
+    if not utils.CACHE_ENABLED:
+        return None
+    with LOCK:
+        with get_connection() as conn:
+            row = conn.execute('SELECT summaries.value FROM pages '
+                               'JOIN summaries USING (digest) '
+                               'WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE pages SET accessed = ? WHERE url = ?',
+                         (time.time(), url))
+    return json.loads(row[0])
+
+
+def set_page_digest(url, digest):
+    """Record the digest of the page described at url."""
+    if not utils.CACHE_ENABLED:
+        return
+    with LOCK:
+        with get_connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?)',
+                         (url, digest, time.time()))
+            conn.execute('DELETE FROM pages WHERE rowid IN ('
+                         'SELECT rowid FROM pages ORDER BY accessed DESC '
+                         'LIMIT -1 OFFSET ?)', (MAX_ENTRIES,))
+
+# Discovery cache functions
+#
+
+
+class DiscoveryCache(object):
+    """Cache of Google API discovery documents for googleapiclient.
+
+       Implements the get and set methods of
+       googleapiclient.discovery_cache.base.Cache, storing documents in the
+       result cache for DISCOVERY_EXPIRE_AFTER seconds.
+    """
+
+    def get(self, url):
+        """Get a cached discovery document, or None if it is not cached."""
+        if not utils.CACHE_ENABLED:
+            return None
+        with LOCK:
+            row = get_connection().execute(
+                'SELECT value, created FROM discovery WHERE url = ?',
+                (url,)).fetchone()
+        if row is None or time.time() - row[1] > DISCOVERY_EXPIRE_AFTER:
+            return None
+        return row[0]
+
+    def set(self, url, content):
+        """Cache a discovery document."""
+        if not utils.CACHE_ENABLED:
+            return
+        with LOCK:
+            with get_connection() as conn:
+                conn.execute('INSERT OR REPLACE INTO discovery '
+                             'VALUES (?, ?, ?)', (url, content, time.time()))
+
+# Requests cache functions
+#
+
+
+def get_expire_after(host):
+    """Return the seconds before cached responses from host expire."""
+    return EXPIRE_AFTER.get(host, EXPIRE_AFTER['*'])
+
+
+def get_cache_headers(url):
+    """Return request headers applying the revalidation window to url.
+
+       Expired responses from search hosts are returned at once and
+       refreshed in the background, unless the thread is revalidating.
+    """
+    if (not REVALIDATE_AFTER or utils.is_revalidating() or
+            urlparse(url).hostname not in REVALIDATE_HOSTS):
+        return {}
+    return {'Cache-Control':
+            'stale-while-revalidate={0}'.format(REVALIDATE_AFTER)}
+
+
+def new_cached_session():
+    """Return a requests session backed by the requests cache.
+
+       Responses expire according to EXPIRE_AFTER, and once there are more
+       than MAX_ENTRIES the least recently used are evicted. In offline mode
+       expired responses are still used.
+    """
+    import requests_cache
+
+    urls_expire_after = dict((host, seconds) for host, seconds
+                             in iteritems(EXPIRE_AFTER) if host != '*')
+    session = requests_cache.CachedSession(
+        utils.CACHE_FILE, backend='sqlite', expire_after=EXPIRE_AFTER['*'],
+        urls_expire_after=urls_expire_after, stale_if_error=utils.OFFLINE)
+    session.hooks['response'].append(record_access)
+    return session
+
+
+def record_access(resp, **kwargs):
+    """Response hook recording when a cached response was last used."""
+    key = getattr(resp, 'cache_key', None)
+    if not key:
+        return
+    with LOCK:
+        with get_connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?)',
+                         (key, time.time()))
+    if not getattr(resp, 'from_cache', False):
+        evict_responses()
+
+
+def evict_responses():
+    """Evict the least recently used responses over the size bound."""
+    responses = utils.get_session().cache.responses
+    excess = len(responses) - MAX_ENTRIES
+    if excess <= 0:
+        return
+
+    with LOCK:
+        accessed = dict(get_connection().execute(
+            'SELECT key, accessed FROM responses').fetchall())
+    # Responses never recorded are treated as the least recently used
+    keys = sorted(responses.keys(), key=lambda key: accessed.get(key, 0))
+    delete_responses(keys[:excess])
+
+
+def delete_responses(keys):
+    """Delete responses from the requests cache by key."""
+    if not keys:
+        return
+    utils.get_session().cache.delete(*keys)
+    with LOCK:
+        with get_connection() as conn:
+            conn.executemany('DELETE FROM responses WHERE key = ?',
+                             [(key,) for key in keys])
+
+
+def parse_age(age):
+    """Return seconds of an age such as 90, 30m, 12h, 7d, or 2w, or None."""
+    match = re.match(r'^(\d+)([smhdw]?)$', age.strip().lower())
+    if match is None:
+        return None
+    return int(match.group(1)) * AGE_UNITS[match.group(2) or 's']
+
+
+def prune(spec):
+    """Prune the requests and result caches instead of clearing them.
+
+    Keyword arguments:
+    spec -- an age such as 12h to remove entries older than it, a glob
+            pattern to remove responses whose URL (or results whose query)
+            matches it, or 'expired' to remove expired entries (str)
+
+    Return the number of responses and results removed.
+    """
+    import requests_cache
+
+    responses = requests_cache.CachedSession(utils.CACHE_FILE,
+                                             backend='sqlite').cache
+    now = time.time()
+    age = parse_age(spec)
+    keys = []
+    for resp in responses.filter(valid=True, expired=True):
+        if spec == 'expired':
+            expired = resp.is_expired
+        elif age is not None:
+            expired = resp.is_older_than(age)
+        else:
+            expired = fnmatch(resp.url, spec)
+        if expired:
+            keys.append(resp.cache_key)
+    if keys:
+        responses.delete(*keys)
+
+    results = 0
+    with LOCK:
+        with get_connection() as conn:
+            conn.executemany('DELETE FROM responses WHERE key = ?',
+                             [(key,) for key in keys])
+            for kind, query, created in conn.execute(
+                    'SELECT kind, query, created FROM results').fetchall():
+                if spec == 'expired':
+                    expire_after = get_expire_after(RESULT_HOSTS[kind])
+                    expired = now - created > expire_after
+                elif age is not None:
+                    expired = now - created > age
+                else:
+                    expired = fnmatch(query, spec)
+                if expired:
+                    conn.execute('DELETE FROM results '
+                                 'WHERE kind = ? AND query = ?', (kind, query))
+                    results += 1
+    return len(keys), results
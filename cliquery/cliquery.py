@@ -6,19 +6,20 @@
 
 from __future__ import absolute_import, print_function
 from argparse import ArgumentParser
-from collections import OrderedDict
 import os
 import sys
+import threading
+import time
 
 from six import PY2, iteritems, itervalues, iterkeys
 from six.moves import input, xrange as range, zip
+from six.moves.urllib.parse import quote_plus
 if not PY2:
     import html
 else:
     from six.moves import html_parser
     html = html_parser.HTMLParser()
 
-from .bookmark import bookmarks, import_bookmarks
 from .config import CONFIG, CONFIG_FPATH, set_config, edit_config
 from .open import open_url
 from . import utils, __version__, CONTINUE, SEE_MORE
@@ -31,32 +32,96 @@ PARSER_HELP = ''
 
 FLAGS_MODIFIED = False  # Set to True once user enters interactive flags
 
+# Google custom search is requested directly from its JSON API (rest), or
+# through the Google API client library (googleapiclient)
+GOOGLE_CLIENTS = ('rest', 'googleapiclient')
+GOOGLE_CLIENT = os.environ.get('CLIQ_GOOGLE_CLIENT', 'rest')
+GOOGLE_SEARCH_URL = 'https://www.googleapis.com/customsearch/v1'
+GOOGLE_FIELDS = 'items(title,formattedUrl,link)'  # Response fields used
+
+GOOGLE_SERVICE = None  # Google custom search client, see get_google_service
+GOOGLE_API_KEY = None  # API key GOOGLE_SERVICE was built with
+GOOGLE_LOCK = threading.Lock()
+GOOGLE_HTTP = threading.local()  # Per-thread HTTP client, see get_google_http
+
+BING_RESULTS = None  # Compiled XPath of result links, see iter_bing_results
+
+# Wolfram pods which are not displayed, by ID (not requested) and title
+WOLFRAM_EXCLUDED_PODS = ('Input', 'NumberLine', 'VisualRepresentation',
+                         'Image', 'ManipulativesIllustration',
+                         'QuotientAndRemainder')
+WOLFRAM_SKIPPED_TITLES = frozenset(['Input', 'Number line',
+                                    'Visual representation', 'Image',
+                                    'Manipulatives illustration',
+                                    'Quotient and remainder'])
+
+# Pods WolframAlpha is slow to compute are sent later and fetched in the
+# background unless CLIQ_WOLFRAM_SYNC is set, see start_wolfram_pods
+WOLFRAM_ASYNC = not os.getenv('CLIQ_WOLFRAM_SYNC')
+WOLFRAM_POOL = None  # Thread pool fetching async pods
+WOLFRAM_LOCK = threading.Lock()
+
+
+def get_runtime_flags(environ):
+    """Return the process-wide options set by an environment (dict)."""
+    return {'race': bool(environ.get('CLIQ_RACE')),
+            'offline': bool(environ.get('CLIQ_OFFLINE')),
+            'hedge': bool(environ.get('CLIQ_HEDGE'))}
+
+
+# Process-wide options, these are not toggled from the link prompt
+RUNTIME_FLAGS = get_runtime_flags(os.environ)
+
 
 def get_parser():
     """Parse command-line arguments."""
     parser = ArgumentParser(description='a command-line browser interface')
     parser.add_argument('query', metavar='QUERY', type=str, nargs='*',
                         help='keywords to search')
+    parser.add_argument('--batch', metavar='FILE', type=str,
+                        help='resolve one query per line of FILE (or - for '
+                        'stdin) and print JSON Lines results')
+    parser.add_argument('--backend', choices=utils.FETCH_BACKENDS,
+                        help='fetch backend for concurrent requests')
     parser.add_argument('-b', '--bookmark', help='view and modify bookmarks',
                         action='store_true')
     parser.add_argument('-c', '--config', help='print config file location',
                         action='store_true')
     parser.add_argument('-C', '--clear-cache', help='clear the cache',
                         action='store_true')
+    parser.add_argument('--cache-prune', metavar='AGE|PATTERN', type=str,
+                        nargs='?', const='expired',
+                        help='remove cached entries older than AGE (such as '
+                        '12h or 7d) or whose URL matches PATTERN, or expired '
+                        'entries if neither is given')
+    parser.add_argument('--daemon', help='run commands from other cliquery '
+                        'processes in this one, keeping it warm',
+                        action='store_true')
     parser.add_argument('-d', '--describe', help='summarize links',
                         action='store_true')
     parser.add_argument('-e', '--edit', help='edit config file',
                         action='store_true')
     parser.add_argument('-f', '--first', help='open first link',
                         action='store_true')
+    parser.add_argument('--hedge', help='resend slow search requests and use '
+                        'the first answer', action='store_true')
     parser.add_argument('-i', '--import', help='import bookmarks from file',
                         type=str, nargs='?')
+    parser.add_argument('-j', '--concurrency', metavar='N', type=int,
+                        default=8, help='number of batch queries resolved at '
+                        'once')
     parser.add_argument('-o', '--open', help='directly open links',
                         action='store_true')
+    parser.add_argument('--offline', help='answer from the cache only',
+                        action='store_true')
     parser.add_argument('-p', '--print', help='print links to stdout',
                         action='store_true')
+    parser.add_argument('--race', help='query WolframAlpha and the web at '
+                        'once', action='store_true')
     parser.add_argument('-s', '--search', help='search for links',
                         action='store_true')
+    parser.add_argument('--serve', metavar='HOST:PORT', type=str,
+                        help='serve searches as a JSON API at HOST:PORT')
     parser.add_argument('-v', '--version', help='display current version',
                         action='store_true')
     parser.add_argument('-w', '--wolfram', help='search WolframAlpha',
@@ -64,12 +129,105 @@ def get_parser():
     return parser
 
 
+def get_bing_url(query):
+    """Get Bing search URL."""
+    return 'http://www.bing.com/search?q={0}'.format(query)
+
+
 def get_bing_resp(query):
     """Get response from Bing search (top 10 results)."""
     if not query:
         return None
 
-    return utils.get_resp('http://www.bing.com/search?q={0}'.format(query))
+    return utils.get_resp(get_bing_url(query))
+
+
+def get_google_items(query, num=10, start=1):
+    """Get items from Google custom search API.
+
+    Keyword arguments:
+    query -- keywords to search (str)
+    num -- number of results, at most 10 (int)
+    start -- index of the first result, starting from 1 (int)
+
+    Return None if Google is unavailable or returned no results.
+    """
+    api_key = CONFIG['google_api_key']
+    engine_key = CONFIG['google_engine_key']
+    if not (api_key and engine_key):
+        return None
+
+    if GOOGLE_CLIENT == 'rest':
+        resp = get_google_rest_resp(query, api_key, engine_key, num, start)
+    elif utils.OFFLINE:
+        # Responses of the Google API client are not cached
+        return None
+    else:
+        service = get_google_service(api_key)
+        if service is None:
+            return None
+        resp = service.cse().list(q=query, cx=engine_key, num=num,
+                                  start=start, fields=GOOGLE_FIELDS).execute(
+                                      http=get_google_http())
+
+    if resp and 'items' in resp:
+        return resp['items']
+    return None
+
+
+def get_google_rest_resp(query, api_key, engine_key, num, start):
+    """Get a response from the Google custom search JSON API as a dict.
+
+       The request is sent with the shared session, so it is pooled, cached,
+       and retried like any other, and the fields mask trims the response to
+       what get_google_links uses. Return None if the request failed.
+    """
+    url = '{0}?q={1}&num={2}&start={3}&fields={4}'.format(
+        GOOGLE_SEARCH_URL, query, num, start, quote_plus(GOOGLE_FIELDS))
+    # Keys are passed as params, errors reported by the API and batch
+    # records hide them (see utils.describe_error)
+    params = {'key': api_key, 'cx': engine_key}
+    try:
+        return utils.send_request(url, params=params).json()
+    except utils.CacheMiss:
+        return None
+    except (IOError, ValueError):
+        sys.stderr.write('Failed to search Google, using Bing.\n')
+        return None
+
+
+def get_google_service(api_key):
+    """Get the Google custom search API client, building it on first use.
+
+       googleapiclient is only imported here, once Google keys are known to
+       be configured. Its discovery document is kept in the result cache.
+       Return None if googleapiclient is not installed.
+    """
+    from .cache import DiscoveryCache
+
+    global GOOGLE_SERVICE, GOOGLE_API_KEY
+    with GOOGLE_LOCK:
+        if GOOGLE_SERVICE is None or GOOGLE_API_KEY != api_key:
+            try:
+                from googleapiclient.discovery import build
+            except ImportError:
+                return None
+            GOOGLE_SERVICE = build('customsearch', 'v1', developerKey=api_key,
+                                   cache=DiscoveryCache())
+            GOOGLE_API_KEY = api_key
+        return GOOGLE_SERVICE
+
+
+def get_google_http():
+    """Get this thread's HTTP client for the Google API client.
+
+       The client's own httplib2 connection is not thread-safe, so each
+       thread sharing the service sends requests with its own.
+    """
+    if getattr(GOOGLE_HTTP, 'http', None) is None:
+        import httplib2
+        GOOGLE_HTTP.http = httplib2.Http(timeout=utils.READ_TIMEOUT)
+    return GOOGLE_HTTP.http
 
 
 def get_google_resp(query):
@@ -77,40 +235,38 @@ def get_google_resp(query):
 
        Return response and True if Google was used (other option is Bing).
     """
-    use_google = True
     if not query:
-        return None, use_google
+        return None, True
 
-    try:
-        from googleapiclient.discovery import build
-    except ImportError:
-        use_google = False
+    items = get_google_items(query)
+    if items:
+        return items, True
 
-    if use_google:
-        api_key = CONFIG['google_api_key']
-        engine_key = CONFIG['google_engine_key']
+    # If no results from Google (or no API keys), use Bing
+    return get_bing_resp(query), False
 
-        resp = ''
-        if api_key and engine_key:
-            service = build("customsearch", "v1", developerKey=api_key)
-            resp = service.cse().list(q=query, cx=engine_key).execute()
 
-        if resp and 'items' in resp:
-            return resp['items'], use_google
-        else:
-            use_google = False
+def get_wolfram_url(query):
+    """Get Wolfram API query URL.
 
-    # If no results from Google (or no API keys), use Bing
-    return get_bing_resp(query), use_google
+       Only plaintext results are requested, without the pods that are never
+       displayed.
+    """
+    base_url = 'http://api.wolframalpha.com/v2/query?input='
+    api_key = CONFIG['wolfram_api_key']
+    params = ''.join('&excludepodid={0}'.format(x)
+                     for x in WOLFRAM_EXCLUDED_PODS)
+    if WOLFRAM_ASYNC:
+        params += '&async=true'
+    return '{0}{1}&appid={2}&format=plaintext{3}'.format(base_url, query,
+                                                         api_key, params)
 
 
 def get_wolfram_resp(query):
-    """Get XML response from Wolfram API as an lxml.html.HtmlElement object."""
+    """Get XML response from Wolfram API as an lxml.etree._Element object."""
     if not query:
         return None
-    base_url = 'http://api.wolframalpha.com/v2/query?input='
-    api_key = CONFIG['wolfram_api_key']
-    return utils.get_resp('{0}{1}&appid={2}'.format(base_url, query, api_key))
+    return utils.get_xml_resp(get_wolfram_url(query))
 
 
 def open_link_range(args, urls, prompt_args):
@@ -330,79 +486,102 @@ def display_link_prompt(args, urls, titles):
             return False
 
 
-def bing_search(args, resp):
-    """Perform a Bing search and display link choice prompt."""
-    if resp is None:
-        return open_url(args, 'https://www.google.com')
-    elif args['open']:
-        return open_url(args, args['query'])
-
+def iter_bing_results(resp):
+    """Yield the URL and title of each Bing result link, in one pass."""
+    global BING_RESULTS
+    if BING_RESULTS is None:
+        from lxml import etree
+        BING_RESULTS = etree.XPath('//h2/a[@href]')
     try:
-        unprocessed_urls = resp.xpath('//h2/a/@href')
-    except AttributeError:
+        anchors = BING_RESULTS(resp)
+    except TypeError:
         raise AttributeError('Failed to retrieve data from lxml object!')
-    if not unprocessed_urls:
-        sys.stderr.write('Failed to retrieve links from Bing.\n')
-        return None
 
-    urls = []
-    titles = []
     base_url = 'www.bing.com'
-    for url in unprocessed_urls:
+    for anchor in anchors:
+        url = anchor.get('href')
         if url.startswith('/') and base_url not in url:
             # Add missing base url
-            urls.append('http://{0}{1}'.format(base_url, url))
-            if "'" in url:
-                ld_xpath = '//h2/a[@href="{0}"]//text()'.format(url)
-            else:
-                ld_xpath = "//h2/a[@href='{0}']//text()".format(url)
-            titles.append(''.join(resp.xpath(ld_xpath)))
+            yield 'http://{0}{1}'.format(base_url, url), anchor.text_content()
         elif url.startswith('http://') or url.startswith('https://'):
-            urls.append(url)
-            if "'" in url:
-                ld_xpath = '//h2/a[@href="{0}"]//text()'.format(url)
-            else:
-                ld_xpath = "//h2/a[@href='{0}']//text()".format(url)
-            titles.append(''.join(resp.xpath(ld_xpath)))
+            yield url, anchor.text_content()
 
-    if urls and titles:
-        return display_link_prompt(args, urls, titles)
-    return False
 
+def get_bing_links(resp):
+    """Extract result URLs and their titles from a Bing response."""
+    urls = []
+    titles = []
+    for url, title in iter_bing_results(resp):
+        urls.append(url)
+        titles.append(title)
+    return urls, titles
 
-def google_search(args, resp):
-    """Perform a Google search and display link choice prompt."""
-    if resp is None:
-        return open_url(args, 'https://www.google.com')
-    elif args['open']:
-        return open_url(args, args['query'])
 
+def get_google_links(resp):
+    """Extract result URLs and their titles from Google search items."""
     raw_urls = [x['formattedUrl'] for x in resp]
     urls = [utils.add_scheme(x) for x in raw_urls]
     titles = [x['title'] for x in resp]
-    if urls and titles:
-        return display_link_prompt(args, urls, titles)
-    return False
-
-
-def bing_open_first(args, resp):
-    """Open the first Bing link available, i.e. 'Feeling Lucky'."""
-    if resp is not None:
-        bing_urls = resp.xpath('//h2/a/@href')
-        if bing_urls:
-            url = bing_urls[0]
-            if url.startswith('http://') or url.startswith('https://'):
-                return open_url(args, url)
-            else:
-                return open_url(args, 'http://{0}'.format(url))
-    print('Results not found.')
+    return urls, titles
+
+
+def get_links(query):
+    """Get result URLs and titles from Google, or Bing as a fallback.
+
+       Return URLs, titles, and True if Google was used (other option is
+       Bing), or None if there is no query. Results are cached by query.
+    """
+    from . import cache
+
+    if not query:
+        return None
+
+    links = cache.get_result('links', query, lambda: fetch_links(query))
+    if links is None:
+        links = fetch_links(query)
+    return links
+
+
+def fetch_links(query):
+    """Get result URLs and titles like get_links, bypassing the result cache.
+
+       The links are cached if there are any. Falling back to Bing shares
+       the search deadline with the Google request.
+    """
+    from . import cache
+
+    with utils.deadline():
+        resp, google = get_google_resp(query)
+    if google:
+        urls, titles = get_google_links(resp)
+    else:
+        urls, titles = get_bing_links(resp)
+    links = (urls, titles, google)
+    if urls:
+        cache.set_result('links', query, links)
+    return links
+
+
+def link_search(args, links):
+    """Perform a Google or Bing search and display link choice prompt."""
+    if links is None:
+        return open_url(args, 'https://www.google.com')
+    elif args['open']:
+        return open_url(args, args['query'])
+
+    urls, titles, google = links
+    if not urls:
+        if google:
+            return False
+        sys.stderr.write('Failed to retrieve links from Bing.\n')
+        return None
+    return display_link_prompt(args, urls, titles)
 
 
-def google_open_first(args, resp):
-    """Open the first Google link available, i.e. 'Feeling Lucky'."""
-    if resp:
-        url = utils.add_scheme(resp[0]['formattedUrl'])
-        return open_url(args, url)
+def open_first(args, links):
+    """Open the first link available, i.e. 'Feeling Lucky'."""
+    if links is not None and links[0]:
+        return open_url(args, links[0][0])
     print('Results not found.')
 
 
@@ -425,39 +604,204 @@ def reformat_wolfram_entries(titles, entries):
     return output_list
 
 
-def wolfram_search(args, resp):
-    """Perform a WolframAlpha search, may require an API key in .cliqrc."""
-    if resp is None:
-        return open_url(args, 'http://www.wolframalpha.com')
-    elif args['open']:
-        return open_url(args, args['query'])
+def get_wolfram_entries(resp, pods=None):
+    """Extract pod titles and plaintext entries from a Wolfram response.
 
+       Pods are walked once, keeping the first plaintext of each titled pod
+       and skipping repeated titles and entries.
+
+    Keyword arguments:
+    resp -- Wolfram API response or async pod (lxml.etree._Element)
+    pods -- titles and entries to add to (tuple) (default: None)
+    """
     try:
-        # Filter unnecessary title fields
-        titles = list(OrderedDict.fromkeys(
-            resp.xpath("//pod[@title != '' and "
-                       "@title != 'Number line' and "
-                       "@title != 'Input' and "
-                       "@title != 'Visual representation' and "
-                       "@title != 'Image' and "
-                       "@title != 'Manipulatives illustration' and "
-                       "@title != 'Quotient and remainder']"
-                       "/@title")))
+        elements = resp.iter('pod')
     except AttributeError:
         raise AttributeError('Failed to retrieve data from lxml object!')
 
-    entries = []
-    if titles:
-        for title in titles:
-            if PY2:
-                title = title.encode('ascii', 'ignore')
-            entry_xpath = ("//pod[@title='{0}']/subpod/plaintext/text()"
-                           .format(title))
-            entry = resp.xpath(entry_xpath)
+    titles, entries = pods or ([], [])
+    for pod in elements:
+        title = pod.get('title')
+        if not title or title in WOLFRAM_SKIPPED_TITLES or title in titles:
+            continue
+        for plaintext in pod.iterfind('subpod/plaintext'):
+            entry = plaintext.text
             if entry:
-                entries.append(entry[0])
+                if entry not in entries:
+                    titles.append(title)
+                    entries.append(entry)
+                break
+    return titles, entries
+
+
+def get_wolfram_async_urls(resp):
+    """Return the URLs of pods WolframAlpha is still computing."""
+    return [pod.get('async') for pod in resp.iter('pod')
+            if pod.get('async') and
+            pod.get('title') not in WOLFRAM_SKIPPED_TITLES]
+
+
+def start_wolfram_pods(query):
+    """Get the first pods from WolframAlpha, fetching async pods in the
+       background.
+
+       Return the pods and futures of the async pods, see add_async_pods.
+       Answered pods are cached here, once the async pods arrive if there
+       are any.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from . import cache
+
+    global WOLFRAM_POOL
+    with utils.deadline():
+        resp = get_wolfram_resp(query)
+        state = utils.get_request_state()
+    pods = get_wolfram_entries(resp)
+    if not wolfram_succeeded(resp):
+        return pods, []
+    urls = get_wolfram_async_urls(resp)
+    if not urls:
+        if wolfram_answered(pods):
+            cache.set_result('wolfram', query, pods)
+        return pods, []
+
+    def fetch_pod(url):
+        # Async pods share the deadline of the first response
+        with utils.request_state(state):
+            return utils.get_xml_resp(url)
+
+    with WOLFRAM_LOCK:
+        if WOLFRAM_POOL is None:
+            WOLFRAM_POOL = ThreadPoolExecutor(max_workers=utils.POOL_MAXSIZE)
+    pending = [WOLFRAM_POOL.submit(fetch_pod, url) for url in urls]
+    cache_async_pods(query, pods, pending)
+    return pods, pending
+
+
+def add_async_pods(pods, pending):
+    """Wait for async pods and add them after the first pods.
+
+    Keyword arguments:
+    pods -- titles and entries of the first pods (tuple)
+    pending -- futures of the async pod responses (list)
+
+    Return the complete pods, see cache_async_pods for caching them.
+    """
+    pods = list(pods[0]), list(pods[1])
+    for pod in pending:
+        try:
+            get_wolfram_entries(pod.result(), pods)
+        except Exception:
+            # Failure is already reported, keep the pods found so far
+            pass
+    return pods
+
+
+def cache_async_pods(query, pods, pending):
+    """Cache the complete pods once every async pod has arrived.
+
+       Pods are cached whether or not they are waited for, such as when the
+       user declines to see more, but not if an async pod failed.
+    """
+    from . import cache
+
+    remaining = [len(pending)]
+
+    def done(future):
+        with WOLFRAM_LOCK:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        if any(x.cancelled() or x.exception() for x in pending):
+            return
+        complete = add_async_pods(pods, pending)
+        if wolfram_answered(complete):
+            cache.set_result('wolfram', query, complete)
+
+    for future in pending:
+        future.add_done_callback(done)
+
+
+def get_first_wolfram_pods(query):
+    """Get pods like get_wolfram_pods without waiting for async pods.
+
+       Return the pods and futures of the async pods, see add_async_pods.
+    """
+    from . import cache
+
+    if not query:
+        return None, []
+
+    pods = cache.get_result('wolfram', query,
+                            lambda: fetch_wolfram_pods(query))
+    if pods is not None:
+        return pods, []
+    return start_wolfram_pods(query)
+
+
+def get_wolfram_pods(query):
+    """Get pod titles and plaintext entries from WolframAlpha.
+
+       Return None if there is no query. Results are cached by query.
+    """
+    from . import cache
+
+    if not query:
+        return None
+
+    pods = cache.get_result('wolfram', query,
+                            lambda: fetch_wolfram_pods(query))
+    if pods is None:
+        pods = fetch_wolfram_pods(query)
+    return pods
+
 
-        entries = list(OrderedDict.fromkeys(entries))
+def fetch_wolfram_pods(query):
+    """Get pod titles and plaintext entries, bypassing the result cache."""
+    pods, pending = start_wolfram_pods(query)
+    if pending:
+        pods = add_async_pods(pods, pending)
+    return pods
+
+
+def wolfram_succeeded(resp):
+    """Return whether a Wolfram response is a successful query result.
+
+       Errors and queries WolframAlpha did not understand are not cached.
+    """
+    return resp.get('success') == 'true'
+
+
+def wolfram_answered(pods):
+    """Return whether Wolfram pods have an answer to display."""
+    if pods is None:
+        return False
+    titles, entries = pods
+    if len(entries) == 1 and entries[0] == '{}':
+        return False
+    return bool(reformat_wolfram_entries(titles, entries))
+
+
+def wolfram_search(args, pods, pending=None):
+    """Perform a WolframAlpha search, may require an API key in .cliqrc.
+
+    Keyword arguments:
+    args -- program arguments (dict)
+    pods -- titles and entries of the pods (tuple)
+    pending -- futures of async pods, shown after SEE_MORE (list)
+    """
+    if pods is None:
+        return open_url(args, 'http://www.wolframalpha.com')
+    elif args['open']:
+        return open_url(args, args['query'])
+
+    if pending and not wolfram_answered(pods):
+        # Nothing to show until the async pods arrive
+        pods = add_async_pods(pods, pending)
+        pending = None
+
+    titles, entries = pods
+    if titles:
         # Return False if results were empty
         if len(entries) == 1 and entries[0] == '{}':
             return False
@@ -465,10 +809,14 @@ def wolfram_search(args, resp):
         output_list = reformat_wolfram_entries(titles, entries)
         if not output_list:
             return False
-        elif len(output_list) > 2:
+        elif len(output_list) > 2 or pending:
             print('\n'.join(output_list[:2]))
+            shown = min(len(output_list), 2)
             if utils.check_input(input(SEE_MORE), empty=True):
-                print('\n'.join(output_list[2:]))
+                if pending:
+                    pods = add_async_pods(pods, pending)
+                    output_list = reformat_wolfram_entries(*pods)
+                print('\n'.join(output_list[shown:]))
         else:
             print('\n'.join(output_list))
         return True
@@ -476,12 +824,68 @@ def wolfram_search(args, resp):
         return False
 
 
+def race_search(args):
+    """Request WolframAlpha and web results at once.
+
+       The WolframAlpha answer is shown if there is one, otherwise the web
+       results that were downloaded in the meantime are used instead.
+    """
+    if utils.use_asyncio():
+        from . import aio
+        pods, links = aio.run(aio.race(args['query'], wolfram_answered))
+        if pods is not None and wolfram_search(args, pods):
+            return True
+        return link_search(args, links or get_links(args['query']))
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    pool = ThreadPoolExecutor(max_workers=2)
+    pods = pool.submit(get_wolfram_pods, args['query'])
+    links = pool.submit(get_links, args['query'])
+    try:
+        try:
+            result = wolfram_search(args, pods.result())
+        except Exception:
+            # Failure is already reported, fall back to the web results
+            result = False
+        if result:
+            return result
+        return link_search(args, links.result())
+    finally:
+        # Ignore the web request if WolframAlpha answered first
+        links.cancel()
+        pool.shutdown(wait=False)
+
+
+def set_runtime_flags(args):
+    """Move process-wide options out of args and into RUNTIME_FLAGS."""
+    for flag in RUNTIME_FLAGS:
+        value = args.pop(flag, None)
+        if value:
+            RUNTIME_FLAGS[flag] = value
+    utils.set_offline(RUNTIME_FLAGS['offline'])
+    utils.HEDGE = RUNTIME_FLAGS['hedge']
+
+
 def search(args):
     """Handle web searching, page previewing, and bookmarks."""
+    set_runtime_flags(args)
+    # The caches and bookmarks are imported by the commands using them, so
+    # that commands such as -v and -c start quickly
     if args['clear_cache']:
+        from . import cache
+        cache.close()
         utils.clear_cache()
+        # A warm session would keep using the deleted cache file
+        utils.close_session()
         print('Cleared {0}.'.format(utils.CACHE_DIR))
         return
+    if args['cache_prune']:
+        from .cache import prune
+        responses, results = prune(args['cache_prune'])
+        print('Pruned {0} responses and {1} results from {2}.'
+              .format(responses, results, utils.CACHE_DIR))
+        return
     if args['config']:
         print(CONFIG_FPATH)
         return
@@ -498,6 +902,7 @@ def search(args):
 
     # Check for bookmark import
     if args['import']:
+        from .bookmark import import_bookmarks
         print('Importing {0}. This will append to existing bookmarks.'
               .format(args['import']))
         try:
@@ -525,55 +930,84 @@ def search(args):
     try:
         if args['bookmark']:
             # Open, add, tag, untag, move, or delete bookmarks
+            from .bookmark import bookmarks
             return bookmarks(args, args['query'])
         if args['first']:
             # Open the first Google link available, i.e. 'Feeling Lucky'
-            resp, google = get_google_resp(args['query'])
-            if google:
-                return google_open_first(args, resp)
-
-            return bing_open_first(args, resp)
+            return open_first(args, get_links(args['query']))
         if args['open']:
             # Print, describe, or open URLs in the browser
             return open_url(args, args['query'])
         if args['search']:
             # Perform a Google search and display link choice prompt
-            resp, google = get_google_resp(args['query'])
-            if google:
-                return google_search(args, resp)
-
-            return bing_search(args, resp)
+            return link_search(args, get_links(args['query']))
         if args['wolfram']:
             # Perform a WolframAlpha search, may require an API key in .cliqrc
-            result = wolfram_search(args, get_wolfram_resp(args['query']))
+            result = wolfram_search(
+                args, *get_first_wolfram_pods(args['query']))
             if not result:
                 print('No answer available from WolframAlpha.')
             return result
 
-        # Default behavior is to check WolframAlpha, then Google.
-        result = wolfram_search(args, get_wolfram_resp(args['query']))
+        if RUNTIME_FLAGS['race']:
+            # Check WolframAlpha and Google at the same time
+            return race_search(args)
+
+        # Default behavior is to check WolframAlpha, then Google. Their
+        # requests share one search deadline, prompts do not count towards it
+        end = time.time() + utils.SEARCH_DEADLINE
+        try:
+            with utils.deadline(end - time.time()):
+                pods = get_first_wolfram_pods(args['query'])
+            result = wolfram_search(args, *pods)
+        except utils.CacheMiss:
+            result = False
         if not result:
-            resp, google = get_google_resp(args['query'])
-            if google:
-                result = google_search(args, resp)
-            else:
-                result = bing_search(args, resp)
+            with utils.deadline(end - time.time()):
+                links = get_links(args['query'])
+            result = link_search(args, links)
 
         return result
+    except utils.CacheMiss:
+        return False
     except (KeyboardInterrupt, EOFError):
         return False
 
 
-def command_line_runner():
-    """Handle command-line interaction."""
+def command_line_runner(argv=None):
+    """Handle command-line interaction.
+
+       argv defaults to the program's arguments, the daemon passes those of
+       its clients.
+    """
     parser = get_parser()
     global PARSER_HELP
     PARSER_HELP = parser.format_help()
-    args = vars(parser.parse_args())
+    args = vars(parser.parse_args(argv))
+    if args.pop('daemon'):
+        from .daemon import serve
+        if not serve():
+            sys.exit(1)
+        return
 
     # Enable cache unless user sets environ variable CLIQ_DISABLE_CACHE
     if not os.getenv('CLIQ_DISABLE_CACHE'):
         utils.enable_cache()
+
+    set_runtime_flags(args)
+    if args['backend']:
+        utils.FETCH_BACKEND = args['backend']
+
+    if args['serve']:
+        from .api import serve
+        if not serve(args['serve']):
+            sys.exit(1)
+        return
+    if args['batch']:
+        from .batch import run_batch
+        if run_batch(args['batch'], args['concurrency']):
+            sys.exit(1)
+        return
     search(args)
 
 
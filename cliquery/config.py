@@ -16,9 +16,16 @@ else:
     CONFIG_FPATH = '{0}/.cliqrc'.format(CONFIG_DIR)
 CONFIG = {}
 
+# Set by the daemon, which cannot start an editor on the user's terminal
+EDIT_DISABLED = False
+
 
 def edit_config():
     """Invoke text editor on configuration file."""
+    if EDIT_DISABLED:
+        sys.stderr.write('Failed to edit config file from the daemon, '
+                         'enter cliquery -e instead.\n')
+        return
     EDITOR = os.environ.get('EDITOR', 'vim')
     subprocess.call([EDITOR, CONFIG_FPATH])
     
@@ -0,0 +1,320 @@
+"""Warm cliquery daemon and the thin client talking to it
+
+   cliquery --daemon keeps the imports, request session, Google client,
+   configuration, and caches of one process warm, and runs commands sent
+   over a Unix domain socket. The cliquery entry point (main) sends its
+   arguments to the daemon if one is running and relays the output and
+   prompts, otherwise it runs the command in-process.
+
+   Messages are frames of a one byte kind, a four byte length, and data:
+   a -- arguments, working directory, and CLIQ_ environment variables of a
+        command, as JSON (to daemon)
+   o, e -- text written to stdout or stderr (to client)
+   r -- request for a line of input, answered with i (to client)
+   i -- a line of input, empty at end of file (to daemon)
+   x -- exit status of the command, ends the exchange (to client)
+   b -- the daemon is busy with another command, or was started with a
+        different environment (to client)
+
+   Only this module and utils are imported by the client, so a command run
+   by the daemon pays for neither Python imports nor new connections.
+"""
+
+from __future__ import absolute_import
+import io
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import traceback
+
+from six import iteritems
+
+from . import utils
+
+
+SOCKET_PATH = os.environ.get('CLIQ_DAEMON_SOCKET',
+                             os.path.join(utils.CACHE_DIR, 'daemon.sock'))
+
+# Commands which must run in the client's own process, such as -e starting
+# an editor on the client's terminal or --serve running a server
+IN_PROCESS_ARGS = frozenset(['--daemon', '-e', '--edit', '--serve'])
+
+# Environment variables of the client applied to each command, commands run
+# in-process if any other CLIQ_ variable differs from the daemon's
+COMMAND_ENV = frozenset(['CLIQ_BACKEND', 'CLIQ_HEDGE', 'CLIQ_OFFLINE',
+                         'CLIQ_RACE'])
+# Environment variables only read by the client
+CLIENT_ENV = frozenset(['CLIQ_DAEMON_SOCKET', 'CLIQ_NO_DAEMON'])
+
+HEADER = struct.Struct('!cI')
+LOCK = threading.Lock()  # Held while the daemon runs a command
+SEND_LOCK = threading.Lock()  # Keeps frames sent by threads whole
+
+
+def send_frame(sock, kind, data=b''):
+    """Send a frame of a kind (bytes) and data (bytes)."""
+    with SEND_LOCK:
+        sock.sendall(HEADER.pack(kind, len(data)) + data)
+
+
+def recv_exactly(sock, size):
+    """Receive size bytes, raise EOFError if the connection closes first."""
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError('Connection closed.')
+        data += chunk
+    return data
+
+
+def recv_frame(sock):
+    """Receive a frame, return its kind and data."""
+    kind, size = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    return kind, recv_exactly(sock, size)
+
+
+class SocketWriter(io.TextIOBase):
+    """Text stream sending writes to the client as frames of a kind."""
+
+    def __init__(self, sock, kind):
+        self.sock = sock
+        self.kind = kind
+
+    def write(self, text):
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+        send_frame(self.sock, self.kind, text.encode('utf-8'))
+        return len(text)
+
+
+class SocketReader(io.TextIOBase):
+    """Text stream reading lines of input from the client."""
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def readline(self, size=-1):
+        send_frame(self.sock, b'r')
+        kind, data = recv_frame(self.sock)
+        return data.decode('utf-8') if kind == b'i' else ''
+
+
+def get_env(environ):
+    """Return the CLIQ_ variables of an environment a command depends on."""
+    return dict((key, value) for key, value in iteritems(environ)
+                if key.startswith('CLIQ_') and key not in CLIENT_ENV)
+
+
+# Client functions
+#
+
+
+def run_client(argv):
+    """Run a command in the daemon, relaying its output and input.
+
+       Return the command's exit status, or None if no daemon is running or
+       it is busy.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(SOCKET_PATH)
+    except (IOError, OSError):
+        sock.close()
+        return None
+
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    stderr = getattr(sys.stderr, 'buffer', sys.stderr)
+    try:
+        request = {'argv': argv, 'cwd': os.getcwd(),
+                   'env': get_env(os.environ)}
+        send_frame(sock, b'a', json.dumps(request).encode('utf-8'))
+        while True:
+            kind, data = recv_frame(sock)
+            if kind == b'o':
+                stdout.write(data)
+                stdout.flush()
+            elif kind == b'e':
+                stderr.write(data)
+                stderr.flush()
+            elif kind == b'r':
+                line = sys.stdin.readline()
+                if not isinstance(line, bytes):
+                    line = line.encode('utf-8')
+                send_frame(sock, b'i', line)
+            elif kind == b'x':
+                return int(data)
+            elif kind == b'b':
+                return None
+    except (IOError, OSError, EOFError):
+        sys.stderr.write('Lost connection to the cliquery daemon.\n')
+        return 1
+    except KeyboardInterrupt:
+        return 1
+    finally:
+        sock.close()
+
+
+def main():
+    """Entry point, run a command in the daemon or else in-process."""
+    argv = sys.argv[1:]
+    options = set(x.split('=')[0] for x in argv)
+    if (not os.environ.get('CLIQ_NO_DAEMON') and
+            not IN_PROCESS_ARGS.intersection(options)):
+        status = run_client(argv)
+        if status is not None:
+            sys.exit(status)
+
+    from .cliquery import command_line_runner
+    command_line_runner()
+
+# Daemon functions
+#
+
+
+def warm_up():
+    """Load the modules, configuration, and session commands need."""
+    # Imported for their side effect of being loaded
+    import lxml.html  # noqa: F401
+    from . import cache, cliquery, pyteaser  # noqa: F401
+    from .config import CONFIG, set_config
+
+    if not os.getenv('CLIQ_DISABLE_CACHE'):
+        utils.enable_cache()
+    utils.get_session()
+    set_config()
+    if (cliquery.GOOGLE_CLIENT == 'googleapiclient' and
+            CONFIG['google_api_key']):
+        cliquery.get_google_service(CONFIG['google_api_key'])
+
+
+def is_same_env(env):
+    """Return whether a client's CLIQ_ variables, other than COMMAND_ENV,
+       match those the daemon was started with.
+    """
+    own = get_env(os.environ)
+    keys = set(own).union(env).difference(COMMAND_ENV)
+    return all(own.get(key) == env.get(key) for key in keys)
+
+
+def run_command(sock, request, state):
+    """Run a command for a client with its stdin, stdout, and stderr.
+
+    Keyword arguments:
+    sock -- connection to the client (socket)
+    request -- argv, cwd, and env of the command (dict)
+    state -- daemon state kept between commands, see serve (dict)
+
+    Return the exit status of the command.
+    """
+    from . import cliquery
+    from .config import CONFIG, CONFIG_FPATH
+
+    # Undo options set by the previous command, applying the client's
+    # environment in their place
+    env = request['env']
+    cliquery.RUNTIME_FLAGS.update(cliquery.get_runtime_flags(env))
+    cliquery.FLAGS_MODIFIED = False
+    utils.FETCH_BACKEND = env.get('CLIQ_BACKEND', 'requests')
+    # Read the configuration again if it changed since it was last read
+    mtime = os.path.getmtime(CONFIG_FPATH)
+    if mtime != state.get('config_mtime'):
+        CONFIG.clear()
+        state['config_mtime'] = mtime
+
+    streams = sys.stdin, sys.stdout, sys.stderr
+    sys.stdin = SocketReader(sock)
+    sys.stdout = SocketWriter(sock, b'o')
+    sys.stderr = SocketWriter(sock, b'e')
+    try:
+        os.chdir(request['cwd'])
+        cliquery.command_line_runner(request['argv'])
+        return 0
+    except SystemExit as err:
+        if err.code is None or isinstance(err.code, int):
+            return err.code or 0
+        sys.stderr.write('{0}\n'.format(err.code))
+        return 1
+    except (KeyboardInterrupt, EOFError):
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = streams
+
+
+def handle_client(sock, state):
+    """Run one client's command, or tell it the daemon is busy."""
+    try:
+        if not LOCK.acquire(False):
+            send_frame(sock, b'b')
+            return
+        try:
+            kind, data = recv_frame(sock)
+            if kind == b'a':
+                request = json.loads(data.decode('utf-8'))
+                if not is_same_env(request['env']):
+                    send_frame(sock, b'b')
+                    return
+                status = run_command(sock, request, state)
+                send_frame(sock, b'x', str(status).encode('utf-8'))
+        finally:
+            LOCK.release()
+    except (IOError, OSError, EOFError):
+        # The client went away
+        pass
+    finally:
+        sock.close()
+
+
+def serve():
+    """Run the daemon until interrupted."""
+    import signal
+    from . import config
+
+    # Refuse to start twice, but replace a socket left by a dead daemon
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(SOCKET_PATH)
+        sys.stderr.write('A cliquery daemon is already running on {0}.\n'
+                         .format(SOCKET_PATH))
+        return False
+    except (IOError, OSError):
+        if os.path.exists(SOCKET_PATH):
+            os.remove(SOCKET_PATH)
+    finally:
+        probe.close()
+
+    warm_up()
+    config.EDIT_DISABLED = True
+    state = {}
+
+    if not os.path.exists(os.path.dirname(SOCKET_PATH)):
+        os.makedirs(os.path.dirname(SOCKET_PATH))
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o177)  # Only the user may connect
+    try:
+        server.bind(SOCKET_PATH)
+    finally:
+        os.umask(umask)
+    server.listen(16)
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    sys.stderr.write('cliquery daemon listening on {0}.\n'
+                     .format(SOCKET_PATH))
+    try:
+        while True:
+            sock, _ = server.accept()
+            thread = threading.Thread(target=handle_client,
+                                      args=(sock, state))
+            thread.daemon = True
+            thread.start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(SOCKET_PATH)
+    return True
@@ -1,16 +1,20 @@
 """Contains cliquery functions to describe and open webpages"""
 
 from __future__ import absolute_import, print_function
+import os
 import sys
 
 from six import PY2
 from six.moves import input
 
 from .config import CONFIG
-from .pyteaser import summarize
 from . import utils, CONTINUE
 
 
+# Maximum number of pages fetched and summarized at once when describing
+DESCRIBE_WORKERS = int(os.environ.get('CLIQ_DESCRIBE_WORKERS', 8))
+
+
 def get_google_query_url(query):
     """Get Google query URL."""
     base_url = 'www.google.com'
@@ -27,17 +31,85 @@ def get_wolfram_query_url(query):
     return 'http://{0}/input/?i={1}'.format(base_url, query)
 
 
-def describe_url(url):
-    """Print a text preview of a given URL."""
+def summarize_resp(resp, url=None):
+    """Return the summary of a webpage response as a list of lines.
+
+    Keyword arguments:
+    resp -- webpage response (lxml.html.HtmlElement)
+    url -- URL of the page, whose summary is then found offline (str)
+    """
+    from .pyteaser import summarize
+    from . import cache
+
+    # Get title and main content for summarization
+    title = utils.get_title(resp)
+    text = utils.get_main_text(resp)
+    if not (title and text):
+        return []
+
+    # Unchanged pages and mirrors share the same cached summary
+    text = ' '.join(text)
+    digest = cache.get_digest(title, text)
+    desc = cache.get_summary(digest)
+    if desc is None:
+        desc = utils.remove_whitespace(summarize(title, text))
+        cache.set_summary(digest, desc)
+    if url is not None:
+        cache.set_page_digest(url, digest)
+    return desc
+
+
+def get_offline_description(url):
+    """Return the summary of the page last described at url.
+
+       Raise CacheMiss if the page was never described.
+    """
+    from . import cache
+
+    desc = cache.get_page_summary(url)
+    if desc is None:
+        sys.stderr.write('Offline and {0} is not cached.\n'.format(url))
+        raise utils.CacheMiss(url)
+    return desc
+
+
+def get_description(url):
+    """Fetch a URL and return its summary as a list of lines."""
+    if utils.OFFLINE:
+        return get_offline_description(url)
+    return summarize_resp(utils.get_streamed_resp(url), url)
+
+
+def start_descriptions(urls):
+    """Fetch and summarize all pages at once.
+
+       Return a future of each URL's summary, in order, and a function
+       releasing the threads or event loop once done with them.
+    """
+    if utils.use_asyncio():
+        from . import aio
+        return aio.describe_all(urls)
+
+    from concurrent.futures import ThreadPoolExecutor
+    from functools import partial
+
+    pool = ThreadPoolExecutor(max_workers=min(len(urls), DESCRIBE_WORKERS))
+    pending = [pool.submit(get_description, url) for url in urls]
+    return pending, partial(pool.shutdown, wait=False)
+
+
+def describe_url(url, pending_desc=None):
+    """Print a text preview of a given URL.
+
+    Keyword arguments:
+    url -- URL to describe (str)
+    pending_desc -- future of the description if already fetching
+    """
     try:
-        # Get title and text for summarization
-        resp = utils.get_resp(url)
-        title = utils.get_title(resp)
-        text = utils.get_text(resp)
-        if title and text:
-            desc = utils.remove_whitespace(summarize(title, ' '.join(text)))
+        if pending_desc is not None:
+            desc = pending_desc.result()
         else:
-            desc = []
+            desc = get_description(url)
         if not desc:
             sys.stderr.write('Failed to describe {0}.\n'.format(url))
             return False
@@ -49,6 +121,9 @@ def describe_url(url):
             print(b'\n'.join(x.encode('utf-8') for x in clean_desc))
         utils.check_input(input(CONTINUE))
         return True
+    except (utils.CacheMiss, IOError):
+        # Failure is already reported, request errors are IOErrors
+        return False
     except AttributeError:
         sys.stderr.write('Failed to describe {0}.\n'.format(url))
         return False
@@ -90,9 +165,20 @@ def open_url(args, urls, prompt_args=None):
             print(url)
         return urls
     elif args['describe']:
-        for url in urls:
-            describe_url(url)
-            print('\n')
+        if not urls:
+            return urls
+
+        # Print each page in order as soon as it is summarized
+        pending, close = start_descriptions(urls)
+        try:
+            for url, pending_desc in zip(urls, pending):
+                describe_url(url, pending_desc)
+                print('\n')
+        finally:
+            # Do not wait on pages left unseen if the user quits early
+            for pending_desc in pending:
+                pending_desc.cancel()
+            close()
         return urls
     else:
         if not urls:
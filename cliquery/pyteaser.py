@@ -3,11 +3,12 @@
 
 from __future__ import absolute_import, print_function
 from collections import Counter
+from itertools import chain
 from math import fabs
 from re import split as regex_split, sub as regex_sub, UNICODE as REGEX_UNICODE
 
-from six import PY2, iterkeys
-from six.moves import zip
+from six import PY2, iteritems
+from six.moves import map, zip
 
 
 STOPWORDS = set([
@@ -71,6 +72,15 @@ STOPWORDS = set([
 
 IDEAL = 20.0
 
+# Sentences scored by position, up to each fraction of the text
+POSITION_SCORES = ((0.1, 0.17), (0.2, 0.23), (0.3, 0.14), (0.4, 0.08),
+                   (0.5, 0.05), (0.6, 0.04), (0.7, 0.06), (0.8, 0.04),
+                   (0.9, 0.04), (1.0, 0.15))
+
+# Texts with this many sentences are scored with NumPy if it is installed
+VECTORIZE_SENTENCES = 100
+NUMPY = None  # numpy module, or False if it is not installed, see get_numpy
+
 
 def summarize(title, text):
     """Summarize text using the title as a reference."""
@@ -90,13 +100,32 @@ def summarize(title, text):
     return [x.encode('utf-8') if PY2 else x for x in summaries]
 
 
+def get_numpy():
+    """Return the numpy module, or None if it is not installed."""
+    global NUMPY
+    if NUMPY is None:
+        try:
+            import numpy
+            NUMPY = numpy
+        except ImportError:
+            NUMPY = False
+    return NUMPY or None
+
+
 def get_score(sentences, title_words, keywords):
-    """Score sentences based on different features."""
+    """Score sentences based on different features.
+
+       Long texts are scored by get_score_vectorized if NumPy is installed.
+    """
     sen_size = len(sentences)
+    if sen_size >= VECTORIZE_SENTENCES and get_numpy() is not None:
+        return get_score_vectorized(sentences, title_words, keywords)
+
+    title_words = [x for x in title_words if x not in STOPWORDS]
     ranks = Counter()
     for i, sen in enumerate(sentences):
         sentence = split_words(sen)
-        title_feature = title_score(title_words, sentence)
+        title_feature = filtered_title_score(title_words, sentence)
         sentence_length = length_score(sentence)
         sentence_pos = sentence_position(i+1, sen_size)
         sbs_feature = sbs(sentence, keywords)
@@ -110,6 +139,80 @@ def get_score(sentences, title_words, keywords):
     return ranks
 
 
+def get_score_vectorized(sentences, title_words, keywords):
+    """Score sentences like get_score, computing each feature for all
+       sentences at once with NumPy.
+
+       The sentences are split into words in one pass and each word is
+       mapped to an integer ID, so word features are looked up by ID and
+       summed by sentence with array operations.
+    """
+    np = get_numpy()
+    sen_size = len(sentences)
+
+    # Word IDs of all sentences, with the sentence and position of each
+    sen_words = split_sentence_words(sentences)
+    words = list(chain.from_iterable(sen_words))
+    word_ids = dict((x, i) for i, x in enumerate(set(words)))
+    ids = np.fromiter(map(word_ids.__getitem__, words), dtype=np.intp,
+                      count=len(words))
+    lengths = np.fromiter(map(len, sen_words), dtype=np.intp, count=sen_size)
+    sen_ids = np.repeat(np.arange(sen_size), lengths)
+    positions = (np.arange(len(words)) -
+                 np.repeat(np.cumsum(lengths) - lengths, lengths))
+    has_words = lengths > 0
+    per_word = np.where(has_words, lengths, 1).astype(np.float64)
+
+    # Keyword score and whether it is a title word, by word ID
+    scores = np.zeros(len(word_ids))
+    in_title = np.zeros(len(word_ids))
+    for word, score in iteritems(keywords):
+        if word in word_ids:
+            scores[word_ids[word]] = score
+    title_words = [x for x in title_words if x not in STOPWORDS]
+    for word in title_words:
+        if word in word_ids:
+            in_title[word_ids[word]] = 1.0
+
+    # Title: occurrences of title words per title word
+    title_feature = np.zeros(sen_size)
+    if title_words:
+        title_feature = (np.bincount(sen_ids, weights=in_title[ids],
+                                     minlength=sen_size) / len(title_words))
+
+    # Length: distance from the ideal number of words
+    sentence_length = 1 - np.abs(IDEAL - lengths) / IDEAL
+
+    # Position: score of the fraction of the text the sentence ends
+    normalized = np.arange(1, sen_size + 1) * 1.0 / sen_size
+    bins = np.searchsorted([x[0] for x in POSITION_SCORES], normalized)
+    sentence_pos = np.append([x[1] for x in POSITION_SCORES], 0)[bins]
+
+    # Summation based selection: keyword scores per word
+    word_scores = scores[ids]
+    sums = np.bincount(sen_ids, weights=word_scores, minlength=sen_size)
+    sbs_feature = np.where(has_words, (1.0 / per_word * sums) / 10.0, 0.0)
+
+    # Density based selection: products of consecutive keywords over their
+    # squared distance, divided by the number of distinct keywords
+    found = np.flatnonzero(word_scores > 0)
+    key_sens = sen_ids[found]
+    pairs = np.flatnonzero(key_sens[1:] == key_sens[:-1])
+    first, second = found[pairs + 1], found[pairs]
+    summ = np.bincount(key_sens[pairs + 1], minlength=sen_size,
+                       weights=(word_scores[first] * word_scores[second] /
+                                (positions[first] - positions[second]) ** 2))
+    distinct = np.unique(key_sens * len(word_ids) + ids[found])
+    k = np.bincount(distinct // max(len(word_ids), 1),
+                    minlength=sen_size) + 1
+    dbs_feature = np.where(has_words, 1.0 / (k * (k + 1.0)) * summ, 0.0)
+
+    frequency = (sbs_feature + dbs_feature) / 2.0 * 10.0
+    total_score = (title_feature*1.5 + frequency*2.0 +
+                   sentence_length*1.0 + sentence_pos*1.0) / 4.0
+    return Counter(dict(zip(sentences, total_score.tolist())))
+
+
 def sbs(words, keywords):
     """Summation based selection."""
     score = 0.0
@@ -142,7 +245,7 @@ def dbs(words, keywords):
                 summ += (first[1]*second[1]) / (dif ** 2)
 
     # Number of intersections
-    k = len(set(iterkeys(keywords)).intersection(set(words))) + 1
+    k = len(set(x for x in words if x in keywords)) + 1
     return 1/(k*(k+1.0))*summ
 
 
@@ -157,6 +260,19 @@ def split_words(text):
         return None
 
 
+def split_sentence_words(sentences):
+    """Split sentences into arrays of words like split_words, cleaning the
+       text of all sentences at once.
+    """
+    text = regex_sub(r'[^\w \x00]', '', '\x00'.join(sentences),
+                     flags=REGEX_UNICODE).lower()
+    sen_words = [x.split() for x in text.split('\x00')]
+    if len(sen_words) != len(sentences):
+        # A sentence contained the separator
+        return [split_words(x) for x in sentences]
+    return sen_words
+
+
 def get_keywords(text):
     """Get the top 10 keywords and their frequency scores
         ignores blacklisted words in STOPWORDS,
@@ -207,10 +323,17 @@ def length_score(sentence):
 
 def title_score(title, sentence):
     """Score the title based on occurrence of words in the sentence."""
-    title = [x for x in title if x not in STOPWORDS]
+    return filtered_title_score([x for x in title if x not in STOPWORDS],
+                                sentence)
+
+
+def filtered_title_score(title, sentence):
+    """Score the title like title_score, for title words that have already
+       been filtered against STOPWORDS.
+    """
     count = 0.0
     for word in sentence:
-        if word not in STOPWORDS and word in title:
+        if word in title:
             count += 1.0
 
     if len(title) == 0:
@@ -224,25 +347,8 @@ def sentence_position(i, size):
         probability of being an important sentence.
     """
     normalized = i*1.0 / size
-    if 0 < normalized <= 0.1:
-        return 0.17
-    elif 0.1 < normalized <= 0.2:
-        return 0.23
-    elif 0.2 < normalized <= 0.3:
-        return 0.14
-    elif 0.3 < normalized <= 0.4:
-        return 0.08
-    elif 0.4 < normalized <= 0.5:
-        return 0.05
-    elif 0.5 < normalized <= 0.6:
-        return 0.04
-    elif 0.6 < normalized <= 0.7:
-        return 0.06
-    elif 0.7 < normalized <= 0.8:
-        return 0.04
-    elif 0.8 < normalized <= 0.9:
-        return 0.04
-    elif 0.9 < normalized <= 1.0:
-        return 0.15
-    else:
-        return 0
+    if normalized > 0:
+        for upper, score in POSITION_SCORES:
+            if normalized <= upper:
+                return score
+    return 0
@@ -10,16 +10,19 @@
 """
 
 from __future__ import absolute_import
+from collections import deque
+from contextlib import contextmanager
 import glob
 import random
 import os
+import re
 import sys
+import threading
+import time
 
-import lxml.html as lh
-import requests
-from six import PY2, iteritems
-from six.moves.urllib.parse import quote_plus
-from six.moves.urllib.request import getproxies
+from six import PY2, iteritems, string_types
+from six.moves import range
+from six.moves.urllib.parse import quote_plus, urlparse
 
 
 USER_AGENTS = ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10.7; rv:11.0) '
@@ -41,12 +44,123 @@ XDG_CACHE_DIR = os.environ.get('XDG_CACHE_HOME',
 CACHE_DIR = os.path.join(XDG_CACHE_DIR, 'cliquery')
 CACHE_FILE = os.path.join(CACHE_DIR, 'cache{0}'.format('' if PY2 else '3'))
 
+# Number of per-host connection pools and connections kept alive per pool
+POOL_CONNECTIONS = int(os.environ.get('CLIQ_POOL_CONNECTIONS', 10))
+POOL_MAXSIZE = int(os.environ.get('CLIQ_POOL_MAXSIZE', 10))
+
+# Streamed pages stop being read after this many bytes, or once the title
+# and this many characters of text have been parsed
+MAX_PAGE_BYTES = int(os.environ.get('CLIQ_MAX_PAGE_BYTES', 2 * 1024 * 1024))
+MIN_PAGE_TEXT = 32 * 1024
+CHUNK_SIZE = 64 * 1024
+
+MAX_BLANK_LINES = 2  # Longest run of blank lines kept, see iter_clean_lines
+
+# A block of page text is main content if it has at least MIN_TEXT_DENSITY
+# words per WRAP_WIDTH characters and at most MAX_LINK_DENSITY of its text
+# is in links, see get_main_text
+MIN_TEXT_DENSITY = 10
+MAX_LINK_DENSITY = 0.33
+WRAP_WIDTH = 80
+BLOCK_TAGS = frozenset(['address', 'article', 'blockquote', 'body', 'dd',
+                        'div', 'dl', 'dt', 'figcaption', 'h1', 'h2', 'h3',
+                        'h4', 'h5', 'h6', 'html', 'li', 'main', 'ol', 'p',
+                        'pre', 'section', 'table', 'td', 'th', 'tr', 'ul'])
+# Elements which are never main content, skipped with everything in them
+SKIPPED_TAGS = frozenset(['aside', 'button', 'footer', 'form', 'head',
+                          'header', 'iframe', 'nav', 'noscript', 'script',
+                          'select', 'style', 'svg', 'template'])
+SKIPPED_ROLES = frozenset(['banner', 'complementary', 'contentinfo',
+                           'dialog', 'menu', 'navigation', 'search'])
+# Whole class names and ids of boilerplate, so that has-sidebar or no-ads
+# on a content element are not mistaken for it
+BOILERPLATE = frozenset(['ad', 'ads', 'advert', 'banner', 'breadcrumb',
+                         'breadcrumbs', 'comment', 'comments', 'consent',
+                         'cookie-banner', 'cookie-consent', 'cookie-notice',
+                         'cookies', 'footer', 'menu', 'nav', 'navbar',
+                         'navigation', 'popup', 'related', 'related-posts',
+                         'share', 'share-buttons', 'sidebar', 'site-footer',
+                         'social', 'sponsored'])
+# Elements whose class or id is not checked against BOILERPLATE, as pages
+# mark them with the state of the whole page
+CONTAINER_TAGS = frozenset(['article', 'body', 'html', 'main'])
+
+# Seconds to wait for a connection and between bytes of a response, and
+# for all the requests of a search including fallbacks and hedges
+CONNECT_TIMEOUT = float(os.environ.get('CLIQ_CONNECT_TIMEOUT', 3.05))
+READ_TIMEOUT = float(os.environ.get('CLIQ_READ_TIMEOUT', 10))
+SEARCH_DEADLINE = float(os.environ.get('CLIQ_DEADLINE', 20))
+
+# Hedged requests send a second attempt if the first has not answered within
+# the host's 95th percentile latency, or HEDGE_AFTER seconds until there are
+# enough LATENCY_SAMPLES to tell
+HEDGE = bool(os.environ.get('CLIQ_HEDGE'))
+HEDGE_AFTER = float(os.environ.get('CLIQ_HEDGE_AFTER', 1))
+LATENCY_SAMPLES = 100
+MIN_LATENCY_SAMPLES = 20
+LATENCIES = {}  # Recent response times by host, see record_latency
+HEDGE_POOL = None  # Thread pool sending hedged attempts, see hedged_request
+
+# Failed requests are retried RETRIES times with jittered exponential
+# backoff starting at RETRY_BACKOFF seconds, after which the URL fails
+# without a request for FAILURE_TTL seconds
+RETRIES = int(os.environ.get('CLIQ_RETRIES', 2))
+RETRY_BACKOFF = float(os.environ.get('CLIQ_RETRY_BACKOFF', 0.5))
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+FAILURE_TTL = float(os.environ.get('CLIQ_FAILURE_TTL', 60))
+
+# A host is considered down after BREAKER_THRESHOLD failed requests in a row,
+# and is probed again every BREAKER_COOLDOWN seconds
+BREAKER_THRESHOLD = int(os.environ.get('CLIQ_BREAKER_THRESHOLD', 5))
+BREAKER_COOLDOWN = float(os.environ.get('CLIQ_BREAKER_COOLDOWN', 30))
+
+FAILED_URLS = {}  # Times until recently failed URLs may be retried
+BREAKERS = {}  # Failures in a row and time the breaker opened by host
+FAILURE_LOCK = threading.Lock()
+
+SESSION = None  # Shared requests session, see get_session
+STREAM_SESSION = None  # Session bypassing the cache, see get_session
+PROXIES = {}  # Proxies by URL scheme and host, see get_request_proxies
+SESSION_LOCK = threading.Lock()
+CACHE_ENABLED = False  # Set to True once the requests cache is installed
+LOCAL = threading.local()  # Per-thread request state, see revalidating
+
+# Offline mode answers from the caches only and never uses the network
+OFFLINE = bool(os.environ.get('CLIQ_OFFLINE'))
+
+# Fetch backend used for concurrent requests, either requests or asyncio
+FETCH_BACKENDS = ('requests', 'asyncio')
+FETCH_BACKEND = os.environ.get('CLIQ_BACKEND', 'requests')
+
+# Query string parameters holding API keys, request errors include the URL
+# so their values are hidden before errors are reported, see describe_error
+SECRET_PARAMS = re.compile(r'([?&](?:appid|cx|key)=)[^&#\s\'"]*')
+
+
+class CacheMiss(Exception):
+    """Raised in offline mode when a response is not cached."""
+
+
+class DeadlineExceeded(IOError):
+    """Raised when a search runs out of time before a request is sent."""
+
+
+class KnownFailure(IOError):
+    """Raised without sending a request to a URL that failed recently or to
+       a host whose circuit breaker is open.
+    """
+
 # Web requests and requests caching functions
 #
+# lxml and requests are imported by the functions using them, so that
+# commands which never make a request start quickly. Request errors are
+# IOErrors, as are requests' own exceptions.
 
 
 def get_proxies():
     """Get available proxies to use with requests library."""
+    from six.moves.urllib.request import getproxies
+
     proxies = getproxies()
     filtered_proxies = {}
     for key, value in iteritems(proxies):
@@ -58,12 +172,449 @@ def get_proxies():
     return filtered_proxies
 
 
+def get_session(cached=True):
+    """Get the shared requests session, creating it on first use.
+
+       Connections are pooled per host and kept alive between requests.
+       Proxies are resolved once per host by session_get.
+
+    Keyword arguments:
+    cached -- if False and the cache is enabled, get a session bypassing
+              it, which reads streamed responses only as far as they are
+              consumed (bool)
+    """
+    global SESSION, STREAM_SESSION, CACHE_ENABLED
+    import requests
+
+    with SESSION_LOCK:
+        if not cached and CACHE_ENABLED:
+            if STREAM_SESSION is None:
+                STREAM_SESSION = configure_session(requests.Session())
+            return STREAM_SESSION
+        if SESSION is None:
+            session = None
+            if CACHE_ENABLED:
+                try:
+                    from .cache import new_cached_session
+                    session = new_cached_session()
+                except ImportError as err:
+                    sys.stderr.write('Failed to enable cache: {0}\n'
+                                     .format(str(err)))
+                    CACHE_ENABLED = False
+            if session is None:
+                session = requests.Session()
+            SESSION = configure_session(session)
+        return SESSION
+
+
+def configure_session(session):
+    """Pool a session's connections and stop it reading the environment."""
+    from requests.adapters import HTTPAdapter
+
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS,
+                          pool_maxsize=POOL_MAXSIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Connection'] = 'keep-alive'
+
+    # Stop requests from rescanning the environment on each request,
+    # proxies are resolved once per host by session_get instead
+    session.trust_env = False
+    session.verify = (os.environ.get('REQUESTS_CA_BUNDLE') or
+                      os.environ.get('CURL_CA_BUNDLE') or True)
+    return session
+
+
+def get_request_proxies(url):
+    """Return the proxies a URL is requested through.
+
+       Proxies come from the environment, none if the host is in no_proxy,
+       and are resolved once per scheme and host.
+    """
+    from requests.utils import get_environ_proxies
+
+    parts = urlparse(url)
+    key = parts.scheme, parts.netloc
+    proxies = PROXIES.get(key)
+    if proxies is None:
+        proxies = dict((k, v) for k, v in iteritems(get_environ_proxies(url))
+                       if k != 'no')
+        if proxies:
+            proxies.update(get_proxies())
+        PROXIES[key] = proxies
+    return proxies
+
+
+def session_get(url, cached=True, **kwargs):
+    """Send a GET request with a shared session and the URL's proxies."""
+    return get_session(cached).get(url, proxies=get_request_proxies(url),
+                                   **kwargs)
+
+
+def close_session():
+    """Close the shared requests sessions and their connection pools."""
+    global SESSION, STREAM_SESSION
+    with SESSION_LOCK:
+        for session in (SESSION, STREAM_SESSION):
+            if session is not None:
+                session.close()
+        SESSION = STREAM_SESSION = None
+
+
+def set_offline(offline):
+    """Enable or disable offline mode."""
+    global OFFLINE
+    if offline != OFFLINE:
+        OFFLINE = offline
+        # Recreate the shared session with the new cache settings
+        close_session()
+
+
+def send_request(url, cached=True, **kwargs):
+    """Send a GET request with the shared session.
+
+       Failed requests are retried (see send_with_retries). In offline mode,
+       or once the URL or its host is known to fail, only cached responses
+       are returned, even if they have expired.
+
+    Keyword arguments:
+    url -- URL to request (str)
+    cached -- whether the response is read from and stored in the requests
+              cache (bool)
+    """
+    headers = {'User-Agent': random.choice(USER_AGENTS)}
+    cached = cached and CACHE_ENABLED
+    if cached:
+        from .cache import get_cache_headers
+        headers.update(get_cache_headers(url))
+    if not OFFLINE:
+        try:
+            check_failures(url)
+        except KnownFailure:
+            # Responses cached before the failure are still good to use
+            if not cached:
+                raise
+            kwargs.setdefault('timeout', get_timeout())
+            request = session_get(url, headers=headers, only_if_cached=True,
+                                  **kwargs)
+            if is_not_cached(request):
+                raise
+            return request
+        return send_with_retries(url, headers, cached, **kwargs)
+
+    request = None
+    if cached:
+        kwargs.setdefault('timeout', get_timeout())
+        request = session_get(url, headers=headers, only_if_cached=True,
+                              **kwargs)
+    if request is None or is_not_cached(request):
+        sys.stderr.write('Offline and {0} is not cached.\n'.format(url))
+        raise CacheMiss(url)
+    return request
+
+
+def is_not_cached(request):
+    """Return whether a cache only request found no cached response."""
+    return request.status_code == 504 and request.reason == 'Not Cached'
+
+
+def hide_secrets(text):
+    """Hide the API keys of URLs in text."""
+    return SECRET_PARAMS.sub(r'\1<hidden>', text)
+
+
+def describe_error(err):
+    """Return the type and message of an error to report, without keys."""
+    return '{0}: {1}'.format(type(err).__name__, hide_secrets(str(err)))
+
+
+def send_with_retries(url, headers, cached=True, **kwargs):
+    """Send a GET request, retrying connection errors, timeouts, and
+       RETRY_STATUSES with jittered exponential backoff.
+
+       Each attempt counts towards the host's circuit breaker. Once the
+       retries are exhausted the URL is remembered as failed for FAILURE_TTL
+       seconds.
+    """
+    import requests
+
+    timeout = kwargs.pop('timeout', None)
+    for attempt in range(RETRIES + 1):
+        if attempt:
+            # Back off without sleeping past the deadline
+            end = getattr(LOCAL, 'deadline', None)
+            delay = random.uniform(0, RETRY_BACKOFF * 2 ** (attempt - 1))
+            if end is not None:
+                delay = max(0, min(delay, end - time.time()))
+            time.sleep(delay)
+            check_failures(url)
+
+        start = time.time()
+        try:
+            request = session_get(url, cached, headers=headers,
+                                  timeout=timeout or get_timeout(), **kwargs)
+            if request.status_code in RETRY_STATUSES:
+                request.close()
+                request.raise_for_status()
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+                requests.exceptions.HTTPError) as err:
+            record_failure(url)
+            error = err
+            continue
+
+        if not getattr(request, 'from_cache', False):
+            record_latency(url, time.time() - start)
+            record_success(url)
+        return request
+
+    with FAILURE_LOCK:
+        FAILED_URLS[url] = time.time() + FAILURE_TTL
+    raise error
+
+
+def check_failures(url):
+    """Raise KnownFailure if url failed recently or its host is down.
+
+       A host's circuit breaker opens after BREAKER_THRESHOLD failures in a
+       row. Once BREAKER_COOLDOWN seconds pass one request is let through to
+       probe the host, closing the breaker if it succeeds.
+    """
+    now = time.time()
+    host = urlparse(url).netloc
+    with FAILURE_LOCK:
+        if FAILED_URLS.get(url, 0) > now:
+            raise KnownFailure('{0} failed recently.'.format(url))
+        FAILED_URLS.pop(url, None)
+
+        failures, opened = BREAKERS.get(host, (0, None))
+        if opened is not None:
+            if now - opened < BREAKER_COOLDOWN:
+                raise KnownFailure('{0} is down, retrying in {1:.0f} seconds.'
+                                   .format(host,
+                                           BREAKER_COOLDOWN - now + opened))
+            # Let this request probe the host, others wait another cooldown
+            BREAKERS[host] = (failures, now)
+
+
+def record_failure(url):
+    """Count a failed request towards its host's circuit breaker."""
+    host = urlparse(url).netloc
+    with FAILURE_LOCK:
+        failures, opened = BREAKERS.get(host, (0, None))
+        failures += 1
+        if failures >= BREAKER_THRESHOLD:
+            opened = time.time()
+        BREAKERS[host] = (failures, opened)
+
+
+def record_success(url):
+    """Close the circuit breaker of a host that answered."""
+    with FAILURE_LOCK:
+        BREAKERS.pop(urlparse(url).netloc, None)
+
+
+@contextmanager
+def deadline(seconds=None):
+    """Bound the time spent on requests sent within the block.
+
+       Requests are given at most the time remaining, and DeadlineExceeded
+       is raised once none is left. Nested deadlines keep the earliest.
+    """
+    previous = getattr(LOCAL, 'deadline', None)
+    end = time.time() + (SEARCH_DEADLINE if seconds is None else seconds)
+    LOCAL.deadline = end if previous is None else min(previous, end)
+    try:
+        yield
+    finally:
+        LOCAL.deadline = previous
+
+
+def get_timeout():
+    """Return the connect and read timeouts for the next request."""
+    end = getattr(LOCAL, 'deadline', None)
+    if end is None:
+        return CONNECT_TIMEOUT, READ_TIMEOUT
+    remaining = end - time.time()
+    if remaining <= 0:
+        raise DeadlineExceeded('Search deadline exceeded.')
+    return min(CONNECT_TIMEOUT, remaining), min(READ_TIMEOUT, remaining)
+
+
+def record_latency(url, seconds):
+    """Record the response time of a request to url's host."""
+    host = urlparse(url).hostname
+    with SESSION_LOCK:
+        if host not in LATENCIES:
+            LATENCIES[host] = deque(maxlen=LATENCY_SAMPLES)
+        LATENCIES[host].append(seconds)
+
+
+def get_hedge_delay(url):
+    """Return the seconds to wait before hedging a request to url."""
+    with SESSION_LOCK:
+        latencies = sorted(LATENCIES.get(urlparse(url).hostname, ()))
+    if len(latencies) < MIN_LATENCY_SAMPLES:
+        return HEDGE_AFTER
+    return latencies[int(len(latencies) * 0.95)]
+
+
+def hedged_request(url, **kwargs):
+    """Send a request like send_request, hedging it if it is slow.
+
+       If the first attempt has not answered within get_hedge_delay, a
+       second one is sent and whichever succeeds first is returned.
+    """
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+    global HEDGE_POOL
+    if not HEDGE or OFFLINE:
+        return send_request(url, **kwargs)
+
+    # Request state is per thread, so pass it on to the attempts
+    state = get_request_state()
+
+    def attempt():
+        with request_state(state):
+            return send_request(url, **kwargs)
+
+    with SESSION_LOCK:
+        if HEDGE_POOL is None:
+            HEDGE_POOL = ThreadPoolExecutor(max_workers=POOL_MAXSIZE)
+    pending = set([HEDGE_POOL.submit(attempt)])
+    done, _ = wait(pending, timeout=get_hedge_delay(url))
+    if not done:
+        pending.add(HEDGE_POOL.submit(attempt))
+
+    while True:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+        # Wait for the other attempt if there is one, else raise the error
+        if not pending:
+            return done.pop().result()
+
+
+@contextmanager
+def revalidating():
+    """Wait for expired cached responses to be refreshed within the block.
+
+       Used to refresh a stale result in the background, where serving the
+       stale response again would defeat the purpose.
+    """
+    LOCAL.revalidating = True
+    try:
+        yield
+    finally:
+        LOCAL.revalidating = False
+
+
+def is_revalidating():
+    """Return whether the current thread is in a revalidating block."""
+    return getattr(LOCAL, 'revalidating', False)
+
+
+def get_request_state():
+    """Return the request state of the current thread, such as its deadline
+       and whether it is revalidating, to pass on to other threads.
+    """
+    return dict(vars(LOCAL))
+
+
+@contextmanager
+def request_state(state):
+    """Send requests within the block with state from get_request_state.
+
+       Used by pooled threads, whose state is cleared again afterwards.
+    """
+    vars(LOCAL).update(state)
+    try:
+        yield
+    finally:
+        vars(LOCAL).clear()
+
+
 def get_resp(url):
     """Get webpage response as an lxml.html.HtmlElement object."""
+    import lxml.html as lh
+
     try:
-        headers = {'User-Agent': random.choice(USER_AGENTS)}
-        request = requests.get(url, headers=headers, proxies=get_proxies())
+        request = hedged_request(url)
         return lh.fromstring(request.content)
+    except CacheMiss:
+        raise
+    except Exception:
+        sys.stderr.write('Failed to retrieve {0}.\n'.format(url))
+        raise
+
+
+def get_xml_resp(url):
+    """Get XML response as an lxml.etree._Element object."""
+    from lxml import etree
+
+    try:
+        request = hedged_request(url)
+        return etree.fromstring(request.content)
+    except CacheMiss:
+        raise
+    except Exception:
+        sys.stderr.write('Failed to retrieve {0}.\n'.format(url))
+        raise
+
+
+def new_page():
+    """Return the state of an incrementally parsed webpage."""
+    import lxml.html as lh
+    from lxml import etree
+
+    parser = etree.HTMLPullParser(events=('end',))
+    parser.set_element_class_lookup(lh.HtmlElementClassLookup())
+    return {'parser': parser, 'bytes': 0, 'text': 0, 'title': False}
+
+
+def feed_page(page, chunk):
+    """Feed a chunk of a webpage to its parser.
+
+       Return True once enough of the page has been read to describe it.
+    """
+    page['parser'].feed(chunk)
+    page['bytes'] += len(chunk)
+    for _, elem in page['parser'].read_events():
+        if elem.tag == 'title':
+            page['title'] = True
+        elif elem.text and elem.tag not in ('script', 'style'):
+            page['text'] += len(elem.text)
+    return (page['bytes'] >= MAX_PAGE_BYTES or
+            (page['title'] and page['text'] >= MIN_PAGE_TEXT))
+
+
+def close_page(page):
+    """Finish parsing a webpage, return it as an lxml.html.HtmlElement."""
+    return page['parser'].close()
+
+
+def get_streamed_resp(url):
+    """Get webpage response as an lxml.html.HtmlElement object.
+
+       The body is streamed into an incremental parser and reading stops
+       early once enough of the page is parsed (see feed_page), so memory
+       stays bounded however large the page is. The requests cache would
+       read the whole body to store it, so pages bypass it and only their
+       summaries are cached.
+    """
+    try:
+        request = send_request(url, cached=False, stream=True)
+        try:
+            page = new_page()
+            for chunk in request.iter_content(CHUNK_SIZE):
+                if feed_page(page, chunk):
+                    break
+        finally:
+            request.close()
+        return close_page(page)
+    except CacheMiss:
+        raise
     except Exception:
         sys.stderr.write('Failed to retrieve {0}.\n'.format(url))
         raise
@@ -72,24 +623,35 @@ def get_resp(url):
 def get_raw_resp(url):
     """Get webpage response as a str object."""
     try:
-        headers = {'User-Agent': random.choice(USER_AGENTS)}
-        request = requests.get(url, headers=headers, proxies=get_proxies())
+        request = send_request(url)
         return request.text.encode('utf-8') if PY2 else request.text
+    except CacheMiss:
+        raise
     except Exception:
         sys.stderr.write('Failed to retrieve {0} as str.\n'.format(url))
         raise
 
 
 def enable_cache():
-    """Enable requests library cache."""
-    try:
-        import requests_cache
-    except ImportError as err:
-        sys.stderr.write('Failed to enable cache: {0}\n'.format(str(err)))
+    """Enable requests library cache.
+
+       requests_cache is imported once the session is created, and the cache
+       is disabled again there if it is not installed.
+    """
+    global CACHE_ENABLED
+    if CACHE_ENABLED:
         return
     if not os.path.exists(CACHE_DIR):
         os.makedirs(CACHE_DIR)
-    requests_cache.install_cache(CACHE_FILE)
+    CACHE_ENABLED = True
+
+    # Recreate the shared session so that it is backed by the cache
+    close_session()
+
+
+def use_asyncio():
+    """Return whether concurrent requests should use the asyncio backend."""
+    return FETCH_BACKEND == 'asyncio'
 
 
 def clear_cache():
@@ -101,55 +663,38 @@ def clear_cache():
 #
 
 
+def iter_clean_lines(lines):
+    """Yield lines with extra whitespace removed, keeping paragraph breaks.
+
+       Whitespace within a line is squeezed to single spaces, blank lines at
+       the start and end are dropped, and runs of blank lines are cut to
+       MAX_BLANK_LINES newlines. Lines are read one at a time, so any
+       iterable, such as a stream, may be given.
+    """
+    blanks = 0
+    started = False
+    for line in lines:
+        clean_line = ' '.join(line.split())
+        if not clean_line:
+            blanks += 1
+            continue
+        if started:
+            for _ in range(min(blanks, MAX_BLANK_LINES)):
+                yield '\n'
+        started = True
+        blanks = 0
+        yield clean_line
+
+
 def remove_whitespace(text):
     """Remove unnecessary whitespace while keeping logical structure
 
        Keyword arguments:
-       text -- text to remove whitespace from (list)
+       text -- text to remove whitespace from (iterable of lines)
 
-        Retain paragraph structure but remove other whitespace,
-        such as between words on a line and at the start and end of the text.
+       Return the lines as a list, see iter_clean_lines.
     """
-    clean_text = []
-    curr_line = ''
-    # Remove any newlines that follow two lines of whitespace consecutively
-    # Also remove whitespace at start and end of text
-    while text:
-        if not curr_line:
-            # Find the first line that is not whitespace and add it
-            curr_line = text.pop(0)
-            while not curr_line.strip() and text:
-                curr_line = text.pop(0)
-            if curr_line.strip():
-                clean_text.append(curr_line)
-        else:
-            # Filter the rest of the lines
-            curr_line = text.pop(0)
-            if text:
-                if curr_line.strip():
-                    clean_text.append(curr_line)
-                else:
-                    # If the current line is whitespace then make sure there is
-                    # no more than one consecutive line of whitespace following
-                    if not text[0].strip():
-                        if len(text) > 1 and text[1].strip():
-                            clean_text.append(curr_line)
-                    else:
-                        clean_text.append(curr_line)
-            else:
-                # Add the final line if it is not whitespace
-                if curr_line.strip():
-                    clean_text.append(curr_line)
-
-    # Now filter each individual line for extraneous whitespace
-    cleaner_text = []
-    clean_line = ''
-    for line in clean_text:
-        clean_line = ' '.join(line.split())
-        if not clean_line.strip():
-            clean_line += '\n'
-        cleaner_text.append(clean_line)
-    return cleaner_text
+    return list(iter_clean_lines(text))
 
 
 def split_title(title, delim):
@@ -187,6 +732,91 @@ def get_text(resp):
     """Return text that is not within a script or style tag."""
     return resp.xpath('//*[not(self::script) and not(self::style)]/text()')
 
+
+def is_boilerplate(elem, tag):
+    """Return whether an element is never main content, by tag, role, or
+       its class and id.
+    """
+    if tag in SKIPPED_TAGS or elem.get('role') in SKIPPED_ROLES:
+        return True
+    if tag in CONTAINER_TAGS:
+        return False
+    names = '{0} {1}'.format(elem.get('class', ''), elem.get('id', ''))
+    return not BOILERPLATE.isdisjoint(names.lower().split())
+
+
+def add_block_text(block, text, in_link):
+    """Add a text node to a block, counting its words and characters."""
+    if text:
+        text = text.strip()
+    if text:
+        block['text'].append(text)
+        block['words'] += len(text.split())
+        block['chars'] += len(text) + 1
+        if in_link:
+            block['link_chars'] += len(text) + 1
+
+
+def is_content(block):
+    """Return whether a block is dense enough in text and sparse enough in
+       links to be main content.
+    """
+    if not block['words']:
+        return False
+    lines = max(1, block['chars'] // WRAP_WIDTH)
+    return (block['words'] / float(lines) >= MIN_TEXT_DENSITY and
+            block['link_chars'] <= MAX_LINK_DENSITY * block['chars'])
+
+
+def get_main_text(resp):
+    """Return the text of a webpage's main content, leaving out boilerplate.
+
+       The page is walked once. Each text node is added to the innermost
+       block (such as a paragraph or list item) it is in, and the block is
+       kept when it ends if is_content. Only the text of open blocks is
+       held at a time. Navigation, footers, and other boilerplate elements
+       are skipped whole. Falls back to get_text if no block is kept.
+    """
+    from lxml import etree
+
+    def new_block():
+        return {'text': [], 'words': 0, 'chars': 0, 'link_chars': 0}
+
+    main_text = []
+    blocks = [new_block()]  # Open blocks, innermost last
+    links = 0  # Number of open links
+    skipped = None  # Element whose subtree is being skipped
+    for event, elem in etree.iterwalk(resp, events=('start', 'end')):
+        if skipped is not None:
+            if event == 'end' and elem is skipped:
+                skipped = None
+                add_block_text(blocks[-1], elem.tail, links)
+            continue
+
+        # Comments and processing instructions have no tag name
+        tag = elem.tag if isinstance(elem.tag, string_types) else None
+        if event == 'start':
+            if tag is None or is_boilerplate(elem, tag):
+                skipped = elem
+                continue
+            if tag in BLOCK_TAGS:
+                blocks.append(new_block())
+            elif tag == 'a':
+                links += 1
+            add_block_text(blocks[-1], elem.text, links)
+        else:
+            if tag in BLOCK_TAGS:
+                block = blocks.pop()
+                if is_content(block):
+                    main_text.append(' '.join(block['text']))
+            elif tag == 'a':
+                links -= 1
+            add_block_text(blocks[-1], elem.tail, links)
+
+    if is_content(blocks[0]):
+        main_text.append(' '.join(blocks[0]['text']))
+    return main_text or get_text(resp)
+
 # URL processing functions
 #
 
@@ -39,7 +39,6 @@ setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
         "Programming Language :: Python :: 3.9",
@@ -56,13 +55,13 @@ setup(
     package_data={'cliquery': ['.cliqrc']},
     entry_points={
         'console_scripts': [
-            'cliquery = cliquery.cliquery:command_line_runner',
+            'cliquery = cliquery.daemon:main',
         ]
     },
     install_requires=[
         'lxml',
         'requests',
-        'requests-cache',
+        'requests-cache>=1.0',
         'six'
     ],
 )
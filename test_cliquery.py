@@ -1,9 +1,21 @@
 #!/usr/bin/env python
 
 """Unit tests for cliquery"""
+import io
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 
-from cliquery import cliquery
+from lxml import etree
+import lxml.html as lh
+
+from cliquery import api, cache, cliquery, daemon, pyteaser
 
 
 class CliqueryTestCase(unittest.TestCase):
@@ -38,5 +50,333 @@ class CliqueryTestCase(unittest.TestCase):
                                 links.startswith('https://'))
 
 
+class ExtractionTestCase(unittest.TestCase):
+
+    def test_bing_links(self):
+        """Bing links are resolved alongside their full titles"""
+        resp = lh.fromstring('<html><body>'
+                             '<h2><a href="http://a.com/x">A <b>b</b></a></h2>'
+                             '<h2><a href="/rel">Rel</a></h2>'
+                             '<h2><a href="#">Ignored</a></h2>'
+                             '<h2><a href="http://q.com/?a=\'&quot;">Q</a>'
+                             '</h2></body></html>')
+        urls, titles = cliquery.get_bing_links(resp)
+        self.assertEqual(urls, ['http://a.com/x', 'http://www.bing.com/rel',
+                                'http://q.com/?a=\'"'])
+        self.assertEqual(titles, ['A b', 'Rel', 'Q'])
+
+    def test_wolfram_entries(self):
+        """Wolfram pods are read as XML, skipping hidden and repeated pods"""
+        resp = etree.fromstring(
+            '<queryresult>'
+            '<pod title="Input"><subpod><plaintext>2+2</plaintext></subpod>'
+            '</pod>'
+            '<pod title="Result"><subpod><plaintext/></subpod>'
+            '<subpod><plaintext>4</plaintext></subpod></pod>'
+            '<pod title="Number name"><subpod><plaintext>four</plaintext>'
+            '</subpod></pod>'
+            '<pod title="Other"><subpod><plaintext>4</plaintext></subpod>'
+            '</pod></queryresult>')
+        self.assertEqual(cliquery.get_wolfram_entries(resp),
+                         (['Result', 'Number name'], ['4', 'four']))
+
+    def test_wolfram_async_pods(self):
+        """Async pods are found by URL and added after the first pods"""
+        resp = etree.fromstring(
+            '<queryresult>'
+            '<pod title="Result"><subpod><plaintext>4</plaintext></subpod>'
+            '</pod><pod title="Number name" async="http://a/1"/>'
+            '</queryresult>')
+        pods = cliquery.get_wolfram_entries(resp)
+        self.assertEqual(cliquery.get_wolfram_async_urls(resp), ['http://a/1'])
+        pod = etree.fromstring('<pod title="Number name"><subpod>'
+                               '<plaintext>four</plaintext></subpod></pod>')
+        self.assertEqual(cliquery.get_wolfram_entries(pod, pods),
+                         (['Result', 'Number name'], ['4', 'four']))
+
+
+class ContentTestCase(unittest.TestCase):
+
+    def test_main_text(self):
+        """Navigation, link lists, and comments are left out of main text"""
+        text = ('Python lists are mutable sequences that grow as items are '
+                'appended and may be sorted in place.')
+        resp = lh.fromstring(
+            '<html><body><nav><a href="/">Home</a> <a href="/a">About</a>'
+            '</nav><div id="cookie-notice">' + text + '</div>'
+            '<article><div class="main has-sidebar no-ads"><p>' + text +
+            '</p></div><!-- ' + text + ' -->'
+            '<ul><li><a href="/1">Lists part 1</a></li></ul></article>'
+            '<div class="comments"><p>' + text + '</p></div></body></html>')
+        self.assertEqual(cliquery.utils.get_main_text(resp), [text])
+
+
+class TextTestCase(unittest.TestCase):
+
+    def test_remove_whitespace(self):
+        """Whitespace is squeezed and blank runs are cut, from any iterable"""
+        lines = iter([' ', 'a   b', ' ', '\t', '  ', '\n', 'c\td', '', ' '])
+        self.assertEqual(cliquery.utils.remove_whitespace(lines),
+                         ['a b', '\n', '\n', 'c d'])
+
+
+class SummaryTestCase(unittest.TestCase):
+
+    @unittest.skipIf(pyteaser.get_numpy() is None, 'NumPy is not installed')
+    def test_vectorized_score(self):
+        """NumPy scores sentences the same as the pure Python path"""
+        words = 'python lists are mutable sequences of objects that grow'
+        sentences = [' '.join(words.split()[i % 9:] * (i % 4)).capitalize()
+                     + '.' for i in range(60)]
+        text = ' '.join(sentences)
+        title = pyteaser.split_words('Python lists')
+        keywords = pyteaser.get_keywords(text)
+        ranks = pyteaser.get_score_vectorized(sentences, title, keywords)
+        # Fewer than VECTORIZE_SENTENCES, so scored in pure Python
+        expected = pyteaser.get_score(sentences, title, keywords)
+        self.assertEqual(list(ranks), list(expected))
+        for sentence, score in expected.items():
+            self.assertAlmostEqual(ranks[sentence], score)
+
+
+class CacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # Each test gets an empty cache in a temporary directory
+        utils = cliquery.utils
+        self.saved = (utils.CACHE_DIR, utils.CACHE_FILE, utils.CACHE_ENABLED,
+                      utils.OFFLINE, cache.RESULTS_FILE, cache.MAX_ENTRIES,
+                      cache.REVALIDATE_AFTER, dict(cache.EXPIRE_AFTER))
+        cache.close()
+        utils.close_session()
+        utils.CACHE_DIR = tempfile.mkdtemp()
+        utils.CACHE_FILE = os.path.join(utils.CACHE_DIR, 'cache')
+        cache.RESULTS_FILE = utils.CACHE_FILE + '_results.sqlite'
+        utils.CACHE_ENABLED = utils.OFFLINE = False
+        utils.enable_cache()
+
+    def tearDown(self):
+        utils = cliquery.utils
+        cache.close()
+        utils.close_session()
+        shutil.rmtree(utils.CACHE_DIR)
+        (utils.CACHE_DIR, utils.CACHE_FILE, utils.CACHE_ENABLED,
+         utils.OFFLINE, cache.RESULTS_FILE, cache.MAX_ENTRIES,
+         cache.REVALIDATE_AFTER, expire_after) = self.saved
+        cache.EXPIRE_AFTER.clear()
+        cache.EXPIRE_AFTER.update(expire_after)
+
+    def save_response(self, url):
+        """Cache a response to url as if it had been requested."""
+        import requests
+        from urllib3 import HTTPResponse
+
+        resp = requests.Response()
+        resp.status_code, resp.url, resp._content = 200, url, b'cached'
+        resp.request = requests.Request('GET', url).prepare()
+        resp.raw = HTTPResponse(body=io.BytesIO(b'cached'), status=200,
+                                preload_content=False)
+        cliquery.utils.get_session().cache.save_response(resp)
+
+    def test_canonical_query(self):
+        """Queries differing in whitespace and case share a cache key"""
+        args = {'bookmark': False, 'open': False}
+        queries = ['Python  lists', ' python lists ', 'PYTHON\tLISTS']
+        keys = set(cache.canonical_query(cliquery.utils.clean_query(args, q))
+                   for q in queries)
+        self.assertEqual(keys, set(['python lists']))
+
+    def test_lru_eviction(self):
+        """Responses over the size bound are evicted least recently used"""
+        session = cliquery.utils.get_session()
+        urls = ['http://cache.test/{0}'.format(i) for i in range(3)]
+        for url in urls:
+            self.save_response(url)
+        # Using the first and last responses leaves the second one unused
+        session.get(urls[0], only_if_cached=True)
+        session.get(urls[2], only_if_cached=True)
+
+        cache.MAX_ENTRIES = 2
+        cache.evict_responses()
+        responses = session.cache.responses.values()
+        self.assertEqual(sorted(x.url for x in responses), [urls[0], urls[2]])
+        self.assertEqual(cache.parse_age('12h'), 12 * 60 * 60)
+        self.assertEqual(cache.parse_age('later'), None)
+        self.assertEqual(cache.prune(urls[0]), (1, 0))
+
+    def test_expiry(self):
+        """Expired results are not used, and are pruned as expired"""
+        links = [['http://a.test/'], ['A'], False]
+        cache.set_result('links', 'python lists', links)
+        self.assertEqual(cache.get_result('links', 'python lists'), links)
+
+        cache.EXPIRE_AFTER['www.bing.com'] = -1
+        self.assertEqual(cache.get_result('links', 'python lists'), None)
+        self.assertEqual(cache.prune('expired'), (0, 1))
+
+    def test_offline(self):
+        """Offline, a cold cache misses at once and expired results are used"""
+        utils = cliquery.utils
+        links = [['http://a.test/'], ['A'], False]
+        cache.set_result('links', 'python lists', links)
+        cache.EXPIRE_AFTER['www.bing.com'] = -1
+        self.save_response('http://cache.test/cached')
+
+        utils.set_offline(True)
+        self.assertEqual(cache.get_result('links', 'python lists'), links)
+        self.assertEqual(utils.send_request('http://cache.test/cached')
+                         .content, b'cached')
+        self.assertRaises(utils.CacheMiss, utils.send_request,
+                          'http://cache.test/cold')
+
+    def test_offline_description(self):
+        """Offline, a page is described with its last summary"""
+        from cliquery.open import get_description, summarize_resp
+
+        utils = cliquery.utils
+        text = ('Python lists are mutable sequences that grow as items are '
+                'appended. Lists may be sorted in place or copied. ')
+        resp = lh.fromstring('<html><head><title>Python lists</title></head>'
+                             '<body><article><p>' + text * 3 +
+                             '</p></article></body></html>')
+        desc = summarize_resp(resp, 'http://cache.test/lists')
+        self.assertTrue(desc)
+
+        utils.set_offline(True)
+        self.assertEqual(get_description('http://cache.test/lists'), desc)
+        self.assertRaises(utils.CacheMiss, get_description,
+                          'http://cache.test/cold')
+
+    def test_revalidation(self):
+        """A stale hit is served while refreshed once in the background"""
+        utils = cliquery.utils
+        links = [['http://a.test/'], ['A'], False]
+        cache.set_result('links', 'python lists', links)
+        cache.EXPIRE_AFTER['www.bing.com'] = -1
+        cache.REVALIDATE_AFTER = 60
+
+        refreshes = []
+        release = threading.Event()
+
+        def refresh():
+            refreshes.append(utils.is_revalidating())
+            release.wait(5)
+
+        for _ in range(2):
+            self.assertEqual(cache.get_result('links', 'python lists',
+                                              refresh), links)
+        release.set()
+        while cache.REVALIDATING:
+            time.sleep(0.01)
+        self.assertEqual(refreshes, [True])
+
+
+class RequestTestCase(unittest.TestCase):
+
+    def test_deadline(self):
+        """Nested deadlines keep the earliest and expire before sending"""
+        utils = cliquery.utils
+        self.assertEqual(utils.get_timeout(),
+                         (utils.CONNECT_TIMEOUT, utils.READ_TIMEOUT))
+        with utils.deadline(2):
+            with utils.deadline(60):
+                self.assertTrue(utils.get_timeout()[1] <= 2)
+            with utils.deadline(0):
+                self.assertRaises(utils.DeadlineExceeded, utils.get_timeout)
+
+    def test_request_state(self):
+        """Pooled threads send requests with the caller's state"""
+        utils = cliquery.utils
+        found = []
+
+        def run(state):
+            with utils.request_state(state):
+                found.append((utils.get_timeout()[1] <= 2,
+                              utils.is_revalidating()))
+            found.append(utils.is_revalidating())
+
+        with utils.deadline(2):
+            with utils.revalidating():
+                thread = threading.Thread(target=run,
+                                          args=(utils.get_request_state(),))
+                thread.start()
+                thread.join()
+        self.assertEqual(found, [(True, True), False])
+
+    def test_circuit_breaker(self):
+        """A host fails fast once down and is probed after the cooldown"""
+        utils = cliquery.utils
+        url = 'http://down.invalid/'
+        for _ in range(utils.BREAKER_THRESHOLD):
+            utils.check_failures(url)
+            utils.record_failure(url)
+        self.assertRaises(utils.KnownFailure, utils.check_failures, url)
+
+        host = 'down.invalid'
+        failures, opened = utils.BREAKERS[host]
+        utils.BREAKERS[host] = (failures, opened - utils.BREAKER_COOLDOWN)
+        utils.check_failures(url)
+        self.assertRaises(utils.KnownFailure, utils.check_failures, url)
+        utils.record_success(url)
+        utils.check_failures(url)
+
+
+class StartupTestCase(unittest.TestCase):
+
+    def test_lazy_imports(self):
+        """Importing cliquery does not load lxml, requests, or the caches"""
+        code = ('import sys, cliquery.cliquery; '
+                'print(" ".join(m for m in ("lxml", "requests", "sqlite3", '
+                '"cliquery.cache", "cliquery.pyteaser") if m in sys.modules))')
+        output = subprocess.check_output(
+            [sys.executable, '-c', code],
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(output.strip(), b'')
+
+
+class DaemonTestCase(unittest.TestCase):
+
+    def test_frames(self):
+        """Output and input lines are relayed between daemon and client"""
+        server, client = socket.socketpair()
+        try:
+            daemon.SocketWriter(server, b'o').write(u'links\n')
+            self.assertEqual(daemon.recv_frame(client), (b'o', b'links\n'))
+
+            daemon.send_frame(client, b'i', b'1\n')
+            self.assertEqual(daemon.SocketReader(server).readline(), u'1\n')
+            self.assertEqual(daemon.recv_frame(client), (b'r', b''))
+        finally:
+            server.close()
+            client.close()
+
+    def test_same_env(self):
+        """Only per-command variables may differ from the daemon's"""
+        env = daemon.get_env(os.environ)
+        self.assertTrue(daemon.is_same_env(dict(env, CLIQ_OFFLINE='1')))
+        self.assertFalse(daemon.is_same_env(dict(env,
+                                                 CLIQ_RETRIES='9')))
+
+
+class ApiTestCase(unittest.TestCase):
+
+    def test_answer(self):
+        """Endpoints answer with a status and a JSON object"""
+        self.assertEqual(api.answer('/health', {})[0], 200)
+        self.assertEqual(api.answer('/search', {'q': [' ']})[0], 400)
+        self.assertEqual(api.answer('/nonexistent', {})[0], 404)
+        self.assertEqual(api.parse_address('8080'), ('127.0.0.1', 8080))
+        self.assertEqual(api.parse_address('0.0.0.0:80'), ('0.0.0.0', 80))
+
+    def test_hidden_keys(self):
+        """API keys in the URLs of reported errors are hidden"""
+        err = IOError('Max retries exceeded with url: /v2/query?input=pi'
+                      '&appid=SECRET&format=plaintext')
+        self.assertEqual(cliquery.utils.describe_error(err),
+                         type(err).__name__ + ': Max retries exceeded with '
+                         'url: /v2/query?input=pi&appid=<hidden>'
+                         '&format=plaintext')
+
+
 if __name__ == '__main__':
     unittest.main()